@@ -1,7 +1,14 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+
 import librosa
+import numpy as np
 from audiomentations import AddGaussianNoise, PitchShift, Shift, AddGaussianSNR, AirAbsorption, BandPassFilter, Limiter, \
     Trim, TimeStretch, TimeMask, TanhDistortion, Reverse
 import soundfile as sf
+import torch
+from ml_scripts import metrics
+from ml_scripts.metadata_store import get_metadata_store
 from ml_scripts.utils import *
 
 # Define audio augmentations
@@ -34,40 +41,139 @@ transformations = [
     ('reverse', reverse)
 ]
 
+# Number of augmented copies written per recording in materialized augmentation mode.
+# A recording with audio id N gets the copies N + 1 .. N + AUGMENTED_COPIES.
+AUGMENTED_COPIES = len(transformations)
+
+# Online augmentation: probability that a sample is augmented at all,
+# and the maximum number of transformations chained on one sample
+ONLINE_AUGMENTATION_PROBABILITY = 0.9
+ONLINE_MAX_TRANSFORMATIONS = 3
+
+# Base seed of the augmentations. Every transformation gets its own seed derived from it,
+# so the result does not depend on which worker process runs the transformation.
+AUGMENTATION_SEED = 0
+AUGMENTATION_WORKERS = os.cpu_count() or 1
+
+_augmentation_executor = None
+
+
+def get_augmentation_executor():
+    """ Return the process pool used for augmentation, creating it on first use """
+    global _augmentation_executor
+    if _augmentation_executor is None:
+        _augmentation_executor = ProcessPoolExecutor(max_workers=AUGMENTATION_WORKERS)
+    return _augmentation_executor
+
 
-def augment_audio(wav_file_path, class_name, class_id, last_audio_id):
+def _apply_transformation(transformation_index, seed, audio_array, sample_rate, output_path):
+    """
+    Apply one transformation and write the result. Runs in a worker process.
+    """
+    # audiomentations draws its parameters from both random and numpy.random
+    random.seed(seed)
+    np.random.seed(seed)
+
+    _, transformation = transformations[transformation_index]
+    augmented_audio_array = transformation(audio_array, sample_rate=sample_rate)
+    sf.write(output_path, augmented_audio_array, sample_rate, subtype="PCM_16")
+
+
+def augment_audio(wav_file_path, class_name, class_id, last_audio_id, seed=AUGMENTATION_SEED):
     """
     Augment an audio file and save the augmented versions.
+    The transformations run in parallel in a process pool.
 
     Parameters:
     - wav_file_path (str): Path to the original audio file.
     - class_name (str): Name of the audio class.
     - class_id (int): ID of the audio class.
     - last_audio_id (int): ID of the last audio file.
+    - seed (int): Base seed of the random transformation parameters.
 
     Returns:
-    None
+    list: File names of the augmented audio files.
     """
-    original_audio_array, original_audio_sr = librosa.load(wav_file_path)
+    with metrics.stage("augmentation.load"):
+        # the augmented files are written at the model's sample rate, like the recordings
+        original_audio_array, original_audio_sr = librosa.load(wav_file_path, sr=SAMPLE_RATE, mono=True)
 
     # Get the name and id from the original file
     augmented_audio_file_id = last_audio_id + 1
+    augmented_file_names = []
+    log_rows = []
+    futures = []
+
+    executor = get_augmentation_executor()
 
-    for transformation_name, transformation in transformations:
+    for transformation_index in range(len(transformations)):
         output_file_name = f"{class_id}-{class_name}-{augmented_audio_file_id}.wav"
         output_path = get_file_path(TRAIN_DIR, output_file_name)
 
-        augmented_audio_array = transformation(original_audio_array, sample_rate=int(original_audio_sr))
-        sf.write(output_path, augmented_audio_array, int(original_audio_sr))
+        # audio ids restart at 0 for every speaker, so the class id keeps the speakers' parameters apart
+        transformation_seed = int(np.random.SeedSequence([seed, int(class_id), augmented_audio_file_id])
+                                  .generate_state(1)[0])
+        futures.append(executor.submit(_apply_transformation, transformation_index, transformation_seed,
+                                       original_audio_array, int(original_audio_sr), output_path))
 
         # Log newly created augmented audio file
-        log_data = {
+        log_rows.append({
             'file_name': output_file_name,
             'fold': output_path,
             'classID': class_id,
             'class': class_name
-        }
-
-        log_into_csv(log_data)
+        })
+        augmented_file_names.append(output_file_name)
 
         augmented_audio_file_id += 1
+
+    # the transformations run in the pool, this is the time until the last augmented file is written
+    with metrics.stage("augmentation.transform"):
+        for future in futures:
+            future.result()
+
+    # All rows are appended at once, after every file has been written
+    with metrics.stage("augmentation.metadata"):
+        get_metadata_store().add_rows(log_rows)
+
+    return augmented_file_names
+
+
+class OnlineAugmentation:
+    """
+    Applies a random subset of the transformations to a waveform when it is loaded,
+    so every epoch sees fresh variants of the original recordings without any extra files.
+    """
+
+    def __init__(self, probability=ONLINE_AUGMENTATION_PROBABILITY, max_transformations=ONLINE_MAX_TRANSFORMATIONS):
+        """
+        Parameters:
+        - probability (float): Probability that a sample is augmented.
+        - max_transformations (int): Maximum number of transformations applied to one sample.
+        """
+        self.probability = probability
+        self.max_transformations = max_transformations
+
+    def __call__(self, signal, sample_rate):
+        """
+        Augment a mono (1, samples) waveform.
+
+        Parameters:
+        - signal (torch.Tensor): Waveform to augment.
+        - sample_rate (int): Sample rate of the waveform.
+
+        Returns:
+        torch.Tensor: Augmented (1, samples) waveform. Its length can differ from the input.
+        """
+        if random.random() >= self.probability:
+            return signal
+
+        num_transformations = random.randint(1, self.max_transformations)
+        chosen = sorted(random.sample(range(len(transformations)), num_transformations))
+
+        audio_array = signal[0].cpu().numpy()
+        for transformation_index in chosen:
+            _, transformation = transformations[transformation_index]
+            audio_array = transformation(audio_array, sample_rate=int(sample_rate))
+
+        return torch.from_numpy(np.ascontiguousarray(audio_array, dtype=np.float32)).unsqueeze(0)
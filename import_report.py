@@ -0,0 +1,80 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# Startup imports of the GUI, i.e. everything that is imported before the window is shown
+DEFAULT_MODULE = "main"
+DEFAULT_TOP = 20
+
+
+def measure_imports(module_name=DEFAULT_MODULE):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+    list: (module, self_us, cumulative_us) per imported module, in import order.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module_name} failed:\n{result.stderr}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time:       self [us] |   cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def summarize(imports, top=DEFAULT_TOP):
+    """
+    Summarize measure_imports: total import time, time per top-level package and the slowest modules.
+    """
+    packages = {}
+    for name, self_us, _ in imports:
+        package = name.split(".", 1)[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    return {
+        "total_ms": sum(self_us for _, self_us, _ in imports) / 1000,
+        "module_count": len(imports),
+        "packages_ms": {package: us / 1000 for package, us in
+                        sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]},
+        "modules_cumulative_ms": {name: cumulative_us / 1000 for name, _, cumulative_us in
+                                  sorted(imports, key=lambda item: item[2], reverse=True)[:top]}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import time of the GUI at startup.")
+    parser.add_argument("module", nargs="?", default=DEFAULT_MODULE, help="Module to import (default: main)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="Number of packages and modules to list")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--budget-ms", type=float,
+                        help="Exit with status 1 if the total import time exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    report = summarize(measure_imports(args.module), args.top)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import {args.module}: {report['total_ms']:.1f} ms, {report['module_count']} modules")
+        print("\nSelf time per top-level package:")
+        for package, ms in report["packages_ms"].items():
+            print(f"{ms:>10.1f} ms  {package}")
+        print("\nSlowest modules, including their imports:")
+        for name, ms in report["modules_cumulative_ms"].items():
+            print(f"{ms:>10.1f} ms  {name}")
+
+    if args.budget_ms is not None and report["total_ms"] > args.budget_ms:
+        print(f"Import time {report['total_ms']:.1f} ms exceeds the budget of {args.budget_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import csv
+import importlib
+import multiprocessing
 import os
+import threading
 import customtkinter
 
 from ml_scripts.utils import APP_NAME, MAIN_WINDOW_HEIGHT_PERCENT, MAIN_WINDOW_WIDTH_PERCENT
@@ -7,6 +10,15 @@ from widgets_train_model import TrainModelWidgets
 from widgets_test_model import TestModelWidgets
 from widgets_reset import ResetWidgets
 
+# Heavy ML modules, imported on a background thread once the window is shown.
+# They are also listed in the hiddenimports of main.spec.
+PRELOADED_MODULES = [
+    "ml_scripts.inference",
+    "ml_scripts.streaming",
+    "ml_scripts.train",
+    "augmentation"
+]
+
 
 class VoiceRecorderApp:
     def __init__(self, master):
@@ -119,6 +131,8 @@ class VoiceRecorderApp:
             self.train_model_widgets.hide_widgets()
             self.reset_widgets.hide_widgets()
         elif command == "reset":
+            # a running job would publish a model of the deleted speakers
+            self.train_model_widgets.training_scheduler.reset()
             self.reset_widgets.reset_training()
             self.test_model_widgets.hide_widgets()
             self.train_model_widgets.hide_widgets()
@@ -128,6 +142,18 @@ class VoiceRecorderApp:
             self.reset_widgets.hide_widgets()
 
 
+def preload_ml_modules():
+    """
+    Import the heavy ML modules (torch, torchaudio, librosa, ...), so the first
+    prediction or training does not wait for them. Runs on a background thread.
+    """
+    for module_name in PRELOADED_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"Failed to preload {module_name}: {e}")
+
+
 def main():
     # Create main window 'master'
     master = customtkinter.CTk()
@@ -135,9 +161,14 @@ def main():
     # Initialize VoiceRecorderApp
     VoiceRecorderApp(master)
 
+    # Load the ML modules once the event loop is running and the window is shown
+    master.after(100, lambda: threading.Thread(target=preload_ml_modules, daemon=True).start())
+
     # Start Tkinter Event loop
     master.mainloop()
 
 
 if __name__ == '__main__':
+    # Needed by the augmentation process pool in the PyInstaller build
+    multiprocessing.freeze_support()
     main()
@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=['ml_scripts.inference', 'ml_scripts.streaming', 'ml_scripts.train', 'augmentation'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -1,24 +1,37 @@
-import torch
 from torch.utils.data import Dataset
 import pandas as pd
 import torchaudio
+from ml_scripts import metrics
+from ml_scripts.preprocessing import prepare_signal, mix_down_if_necessary
 from ml_scripts.utils import *
 
 
 class AppDataset(Dataset):
+    """
+    Training clips from the metadata. Samples are returned as CPU tensors, so they can be
+    prepared by DataLoader worker processes; the training loop moves them to the device.
+    """
+
     def __init__(self,
                  annotations_file,
                  audio_dir,
                  transformation,
                  target_sample_rate,
                  num_samples,
-                 device):
-        self.annotations = pd.read_csv(annotations_file)
+                 feature_cache=None,
+                 augmentation=None):
+        # annotations_file is either a metadata CSV file or an already loaded DataFrame
+        if isinstance(annotations_file, pd.DataFrame):
+            self.annotations = annotations_file.reset_index(drop=True)
+        else:
+            self.annotations = pd.read_csv(annotations_file)
         self.audio_dir = audio_dir
-        self.device = device
-        self.transformation = transformation.to(self.device)
+        # without a transformation the dataset returns the prepared waveforms
+        self.transformation = transformation
         self.target_sample_rate = target_sample_rate
         self.num_samples = num_samples
+        self.feature_cache = feature_cache
+        self.augmentation = augmentation
 
     def __len__(self):
         return len(self.annotations)
@@ -26,38 +39,32 @@ class AppDataset(Dataset):
     def __getitem__(self, index):
         audio_sample_path = self._get_audio_sample_path(index)
         label = self._get_audio_sample_label(index)
-        signal, sr = torchaudio.load(audio_sample_path)
-        signal = signal.to(self.device)
-        signal = self._resample_if_necessary(signal, sr)
-        signal = self._mix_down_if_necessary(signal)
-        signal = self._cut_if_necessary(signal)
-        signal = self._right_pad_if_necessary(signal)
-        signal = self.transformation(signal)
-        return signal, label
 
-    def _cut_if_necessary(self, signal):
-        if signal.shape[1] > self.num_samples:
-            signal = signal[:, :self.num_samples]
-        return signal
+        # augmented samples differ every time, so they are never cached
+        use_feature_cache = self.feature_cache is not None and self.augmentation is None
 
-    def _right_pad_if_necessary(self, signal):
-        length_signal = signal.shape[1]
-        if length_signal < self.num_samples:
-            num_missing_samples = self.num_samples - length_signal
-            last_dim_padding = (0, num_missing_samples)
-            signal = torch.nn.functional.pad(signal, last_dim_padding)
-        return signal
+        if use_feature_cache:
+            with metrics.stage("dataset.cache_load"):
+                cached_signal = self.feature_cache.load(audio_sample_path)
+            if cached_signal is not None:
+                return cached_signal, label
 
-    def _resample_if_necessary(self, signal, sr):
-        if sr != self.target_sample_rate:
-            resampler = torchaudio.transforms.Resample(sr, self.target_sample_rate).to(self.device)
-            signal = resampler(signal)
-        return signal
+        with metrics.stage("dataset.decode"):
+            signal, sr = torchaudio.load(audio_sample_path)
+        if self.augmentation is not None:
+            with metrics.stage("dataset.augment"):
+                signal = self.augmentation(mix_down_if_necessary(signal), sr)
+        with metrics.stage("dataset.preprocess"):
+            signal = prepare_signal(signal, sr, self.target_sample_rate, self.num_samples)
+        if self.transformation is not None:
+            with metrics.stage("dataset.mel"):
+                signal = self.transformation(signal)
 
-    def _mix_down_if_necessary(self, signal):
-        if signal.shape[0] > 1:
-            signal = torch.mean(signal, dim=0, keepdim=True)
-        return signal
+        if use_feature_cache:
+            with metrics.stage("dataset.cache_store"):
+                self.feature_cache.store(audio_sample_path, signal)
+
+        return signal, label
 
     def _get_audio_sample_path(self, index):
         # return the audio path, which is stored as second column (index 1) in the metadata file
@@ -0,0 +1,121 @@
+import math
+
+import torch
+from torch import nn
+
+
+class BatchAugmentation(nn.Module):
+    """
+    Torch-native waveform augmentation for a whole (batch, 1, samples) tensor.
+
+    Applies random gain, Gaussian noise at a target SNR, a circular time shift, a time mask and
+    a band-pass filter. Parameters are drawn per sample, and every stage is vectorized over the
+    batch, so it runs on the same device as the model without a per-clip Python loop.
+    Only active in training mode.
+    """
+
+    def __init__(self,
+                 sample_rate,
+                 p=0.5,
+                 min_gain_db=-12.0,
+                 max_gain_db=12.0,
+                 min_snr_db=5.0,
+                 max_snr_db=40.0,
+                 max_shift=0.5,
+                 min_mask_part=0.1,
+                 max_mask_part=0.15,
+                 min_center_freq=100.0,
+                 max_center_freq=6000.0,
+                 min_bandwidth_fraction=0.5,
+                 max_bandwidth_fraction=1.99):
+        """
+        Parameters:
+        - sample_rate (int): Sample rate of the waveforms.
+        - p (float): Probability of applying each stage to a sample.
+        - min_gain_db, max_gain_db (float): Range of the random gain.
+        - min_snr_db, max_snr_db (float): Range of the signal-to-noise ratio of the added noise.
+        - max_shift (float): Maximum time shift, as a fraction of the length.
+        - min_mask_part, max_mask_part (float): Range of the masked length, as a fraction of the length.
+        - min_center_freq, max_center_freq (float): Range of the band-pass center frequency in Hz.
+        - min_bandwidth_fraction, max_bandwidth_fraction (float): Range of the band-pass bandwidth,
+          relative to the center frequency.
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.p = p
+        self.min_gain_db = min_gain_db
+        self.max_gain_db = max_gain_db
+        self.min_snr_db = min_snr_db
+        self.max_snr_db = max_snr_db
+        self.max_shift = max_shift
+        self.min_mask_part = min_mask_part
+        self.max_mask_part = max_mask_part
+        self.min_center_freq = min_center_freq
+        self.max_center_freq = max_center_freq
+        self.min_bandwidth_fraction = min_bandwidth_fraction
+        self.max_bandwidth_fraction = max_bandwidth_fraction
+
+    def forward(self, waveforms):
+        if not self.training:
+            return waveforms
+
+        waveforms = self.gain(waveforms)
+        waveforms = self.band_pass(waveforms)
+        waveforms = self.time_shift(waveforms)
+        waveforms = self.time_mask(waveforms)
+        waveforms = self.add_noise(waveforms)
+        return waveforms
+
+    def gain(self, waveforms):
+        gain_db = self._uniform(waveforms, self.min_gain_db, self.max_gain_db)
+        factor = torch.pow(10.0, gain_db / 20.0)
+        return waveforms * self._where_applied(waveforms, factor, 1.0)
+
+    def add_noise(self, waveforms):
+        snr_db = self._uniform(waveforms, self.min_snr_db, self.max_snr_db)
+        signal_power = waveforms.pow(2).mean(dim=-1, keepdim=True)
+        noise_std = torch.sqrt(signal_power / torch.pow(10.0, snr_db / 10.0))
+        noise = torch.randn_like(waveforms) * self._where_applied(waveforms, noise_std, 0.0)
+        return waveforms + noise
+
+    def time_shift(self, waveforms):
+        num_samples = waveforms.shape[-1]
+        shift = (self._uniform(waveforms, -self.max_shift, self.max_shift) * num_samples).long()
+        shift = self._where_applied(waveforms, shift, 0)
+        positions = torch.arange(num_samples, device=waveforms.device)
+        indices = (positions - shift) % num_samples
+        return torch.gather(waveforms, -1, indices.expand_as(waveforms))
+
+    def time_mask(self, waveforms):
+        num_samples = waveforms.shape[-1]
+        length = (self._uniform(waveforms, self.min_mask_part, self.max_mask_part) * num_samples).long()
+        start = (torch.rand_like(length, dtype=waveforms.dtype) * (num_samples - length)).long()
+        positions = torch.arange(num_samples, device=waveforms.device)
+        masked = (positions >= start) & (positions < start + length)
+        masked = masked & self._applied(waveforms)
+        return waveforms.masked_fill(masked, 0.0)
+
+    def band_pass(self, waveforms):
+        num_samples = waveforms.shape[-1]
+        # log-uniform center frequency, like audiomentations' BandPassFilter
+        log_center = self._uniform(waveforms, math.log(self.min_center_freq), math.log(self.max_center_freq))
+        center = torch.exp(log_center)
+        bandwidth = center * self._uniform(waveforms, self.min_bandwidth_fraction, self.max_bandwidth_fraction)
+        low, high = center - bandwidth / 2, center + bandwidth / 2
+
+        spectrum = torch.fft.rfft(waveforms, dim=-1)
+        frequencies = torch.fft.rfftfreq(num_samples, d=1.0 / self.sample_rate).to(waveforms.device)
+        passband = ((frequencies >= low) & (frequencies <= high)).to(waveforms.dtype)
+        passband = self._where_applied(waveforms, passband, 1.0)
+        return torch.fft.irfft(spectrum * passband, n=num_samples, dim=-1)
+
+    def _uniform(self, waveforms, low, high):
+        # one value per sample, broadcastable over (batch, 1, samples)
+        shape = (waveforms.shape[0],) + (1,) * (waveforms.dim() - 1)
+        return low + (high - low) * torch.rand(shape, device=waveforms.device, dtype=waveforms.dtype)
+
+    def _applied(self, waveforms):
+        return self._uniform(waveforms, 0.0, 1.0) < self.p
+
+    def _where_applied(self, waveforms, value, default):
+        return torch.where(self._applied(waveforms), value, torch.as_tensor(default, device=waveforms.device))
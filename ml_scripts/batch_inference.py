@@ -0,0 +1,152 @@
+import argparse
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torchaudio
+from ml_scripts.inference import get_inference_engine
+from ml_scripts.utils import *
+
+BATCH_INFERENCE_BATCH_SIZE = 256
+DECODE_WORKERS = os.cpu_count() or 1
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3")
+
+
+def find_audio_files(audio_dir):
+    """
+    Recursively collect the audio files of a directory in a stable order.
+    """
+    audio_files = []
+    for root, _, filenames in os.walk(audio_dir):
+        for filename in filenames:
+            if filename.lower().endswith(AUDIO_EXTENSIONS):
+                audio_files.append(os.path.join(root, filename))
+    return sorted(audio_files)
+
+
+def _load_audio(audio_file):
+    try:
+        return torchaudio.load(audio_file), None
+    except Exception as e:
+        return None, str(e)
+
+
+def classify_files(audio_files, batch_size=BATCH_INFERENCE_BATCH_SIZE, num_workers=DECODE_WORKERS):
+    """
+    Classify audio files in batches. Files are decoded by a thread pool, and the next batch is
+    decoded while the current one is preprocessed and run through the model.
+
+    Parameters:
+    - audio_files (list): Paths of the audio files.
+    - batch_size (int): Number of files per forward pass.
+    - num_workers (int): Number of decoding threads.
+
+    Returns:
+    generator: (audio_file, predicted class or None, probabilities or None, error or None) tuples.
+    """
+    engine = get_inference_engine()
+    batches = [audio_files[i:i + batch_size] for i in range(0, len(audio_files), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        def submit(batch):
+            return [executor.submit(_load_audio, audio_file) for audio_file in batch]
+
+        pending = submit(batches[0]) if batches else []
+        for batch_index, batch in enumerate(batches):
+            decoded = [future.result() for future in pending]
+            if batch_index + 1 < len(batches):
+                pending = submit(batches[batch_index + 1])
+
+            signals = [audio for audio, _ in decoded if audio is not None]
+            probabilities, class_mapping = engine.classify_signals(signals) if signals else ([], None)
+            probabilities = iter(probabilities)
+
+            for audio_file, (audio, error) in zip(batch, decoded):
+                if audio is None:
+                    yield audio_file, None, None, error
+                    continue
+                file_probabilities = next(probabilities)
+                yield audio_file, class_mapping[file_probabilities.argmax(0)], file_probabilities, None
+
+
+def write_predictions(results, output_path, class_mapping, output_format=None):
+    """
+    Write classification results as CSV or JSONL.
+
+    Parameters:
+    - results (iterable): Tuples produced by classify_files.
+    - output_path (str): Destination file.
+    - class_mapping (list): Class names, in the order of the probabilities.
+    - output_format (str): "csv" or "jsonl". Derived from the file extension if not given.
+
+    Returns:
+    int: Number of written rows.
+    """
+    if output_format is None:
+        output_format = "jsonl" if output_path.lower().endswith((".jsonl", ".json")) else "csv"
+
+    num_rows = 0
+    with open(output_path, "w", newline="") as output_file:
+        if output_format == "csv":
+            writer = csv.writer(output_file)
+            writer.writerow(["file", "predicted"] + [f"p_{name}" for name in class_mapping] + ["error"])
+
+        for audio_file, predicted, probabilities, error in results:
+            probabilities = probabilities.tolist() if probabilities is not None else None
+
+            if output_format == "csv":
+                writer.writerow([audio_file, predicted or ""] +
+                                (probabilities or [""] * len(class_mapping)) +
+                                [error or ""])
+            else:
+                record = {"file": audio_file, "predicted": predicted, "error": error}
+                if probabilities is not None:
+                    record["probabilities"] = dict(zip(map(str, class_mapping), probabilities))
+                output_file.write(json.dumps(record) + "\n")
+            num_rows += 1
+
+    return num_rows
+
+
+def classify_directory(audio_dir, output_path, batch_size=BATCH_INFERENCE_BATCH_SIZE,
+                       num_workers=DECODE_WORKERS, output_format=None):
+    """
+    Classify every audio file of a directory and write the predictions to output_path.
+
+    Returns:
+    dict: Number of files, elapsed seconds and throughput in files per second.
+    """
+    audio_files = find_audio_files(audio_dir)
+
+    engine = get_inference_engine()
+    engine.reload_if_changed()
+
+    start_time = time.perf_counter()
+    results = classify_files(audio_files, batch_size, num_workers)
+    num_files = write_predictions(results, output_path, list(engine.class_mapping), output_format)
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "files": num_files,
+        "seconds": elapsed,
+        "files_per_second": num_files / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a directory of audio files with the trained model.")
+    parser.add_argument("audio_dir", help="Directory with the audio files, searched recursively")
+    parser.add_argument("-o", "--output", default="predictions.csv", help="CSV or JSONL output file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Output format, default from extension")
+    parser.add_argument("--batch-size", type=int, default=BATCH_INFERENCE_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DECODE_WORKERS, help="Number of decoding threads")
+    args = parser.parse_args()
+
+    stats = classify_directory(args.audio_dir, args.output, args.batch_size, args.workers, args.format)
+    print(f"Classified {stats['files']} files in {stats['seconds']:.2f}s "
+          f"({stats['files_per_second']:.1f} files/s)")
+
+
+if __name__ == "__main__":
+    main()
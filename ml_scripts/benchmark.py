@@ -0,0 +1,355 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+import pandas as pd
+import torch
+from torch import nn
+from augmentation import augment_audio
+from ml_scripts import metrics
+from ml_scripts.AppDataset import AppDataset
+from ml_scripts.cnn import CNNNetwork, NUM_CLASSES
+from ml_scripts.feature_cache import FeatureCache
+from ml_scripts.inference import get_inference_engine
+from ml_scripts.metadata_store import get_metadata_store
+from ml_scripts.preprocessing import prepare_signal
+from ml_scripts.train import BATCH_SIZE, LEARNING_RATE, NUM_WORKERS, create_data_loader, train_single_epoch
+from ml_scripts.utils import *
+
+BENCHMARK_SEED = 0
+BENCHMARK_SPEAKERS = 4
+BENCHMARK_CLIPS_PER_SPEAKER = 8
+# Synthetic clips are a bit longer than NUM_SAMPLES, so they are cut like real recordings
+BENCHMARK_CLIP_SECONDS = 1.5
+BENCHMARK_REPEATS = 3
+BENCHMARK_EPOCHS = 2
+BENCHMARK_AUGMENTED_CLIPS = 2
+
+BENCHMARKS = ["dataset_getitem", "dataset_getitem_cached", "mel_transform", "train_epoch", "predict_pcm",
+              "predict_file", "augment_audio"]
+
+
+def synthesize_clip(rng, f0, formants, duration, sample_rate):
+    """
+    A voiced, speech-like clip: harmonics of a wobbling fundamental frequency f0, weighted by
+    the speaker's formants and modulated into syllables, plus a little noise.
+
+    Returns:
+    np.ndarray: int16 samples.
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    vibrato = 1 + 0.05 * np.sin(2 * np.pi * rng.uniform(2, 5) * t)
+    phase = 2 * np.pi * np.cumsum(f0 * vibrato) / sample_rate
+
+    signal = np.zeros_like(t)
+    for harmonic in range(1, int(sample_rate / 2 / f0)):
+        amplitude = sum(np.exp(-((harmonic * f0 - formant) / 150.0) ** 2) for formant in formants)
+        signal += amplitude * np.sin(harmonic * phase)
+
+    syllables = 0.5 * (1 - np.cos(2 * np.pi * rng.uniform(3, 5) * t + rng.uniform(0, np.pi)))
+    signal = signal * syllables + rng.normal(0, 0.01, len(t))
+    signal = 0.5 * signal / max(np.abs(signal).max(), 1e-9)
+    return (signal * 32767).astype(np.int16)
+
+
+def write_wav(file_path, samples, sample_rate):
+    # mono 16-bit, like the recordings of the "Train Model" page
+    with wave.open(file_path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(samples.tobytes())
+
+
+def generate_dataset(speakers, clips_per_speaker, duration, seed=BENCHMARK_SEED, sample_rate=RECORDING_SAMPLE_RATE):
+    """
+    Write synthetic speaker recordings to TRAIN_DIR and enroll them in the metadata store.
+    The clips are fully determined by the seed. They are written at the fallback recording rate
+    by default, so decoding includes resampling like for clips that were not canonicalized.
+
+    Returns:
+    pd.DataFrame: Metadata of the generated clips.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for class_id in range(speakers):
+        class_name = f"speaker{class_id}"
+        f0 = rng.uniform(90, 250)
+        formants = [rng.uniform(300, 900), rng.uniform(900, 2500), rng.uniform(2500, 3500)]
+
+        for audio_id in range(clips_per_speaker):
+            file_name = f"{class_id}-{class_name}-{audio_id}.wav"
+            file_path = get_file_path(TRAIN_DIR, file_name)
+            write_wav(file_path, synthesize_clip(rng, f0, formants, duration, sample_rate), sample_rate)
+            rows.append({'file_name': file_name, 'fold': file_path, 'classID': class_id, 'class': class_name})
+
+    get_metadata_store().add_rows(rows)
+    return pd.DataFrame(rows)
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process and of its finished child processes, or None """
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20
+    }
+
+
+def summarize(timings, items_per_run=1):
+    """
+    Latency percentiles and throughput of a list of run durations in seconds.
+    """
+    timings = np.asarray(timings)
+    total_time = timings.sum()
+    return {
+        "runs": len(timings),
+        "items": len(timings) * items_per_run,
+        "mean_ms": timings.mean() * 1000,
+        "p50_ms": np.percentile(timings, 50) * 1000,
+        "p99_ms": np.percentile(timings, 99) * 1000,
+        "throughput_per_s": len(timings) * items_per_run / total_time if total_time > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def time_runs(run, repeats, warmup=1):
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def benchmark_dataset_getitem(metadata, repeats, feature_cache=None):
+    dataset = AppDataset(metadata, resource_path(TRAIN_DIR), get_mel_spectrogram(), SAMPLE_RATE, NUM_SAMPLES,
+                         feature_cache)
+    timings = []
+    for index in range(len(dataset)):
+        timings.extend(time_runs(lambda: dataset[index], repeats))
+    return summarize(timings)
+
+
+def benchmark_mel_transform(metadata, repeats):
+    import torchaudio
+
+    transformation = get_mel_spectrogram()
+    timings = []
+    for fold in metadata["fold"]:
+        signal = prepare_signal(*torchaudio.load(fold))
+        timings.extend(time_runs(lambda: transformation(signal), repeats))
+    return summarize(timings)
+
+
+def benchmark_train_epoch(metadata, epochs, num_workers, device):
+    torch.manual_seed(BENCHMARK_SEED)
+    dataset = AppDataset(metadata, resource_path(TRAIN_DIR), get_mel_spectrogram(), SAMPLE_RATE, NUM_SAMPLES)
+    data_loader = create_data_loader(dataset, BATCH_SIZE, shuffle=True, num_workers=num_workers)
+
+    cnn = CNNNetwork(max(NUM_CLASSES, int(metadata["classID"].max()) + 1)).to(device)
+    loss_fn = nn.CrossEntropyLoss()
+    optimiser = torch.optim.Adam(cnn.parameters(), lr=LEARNING_RATE)
+
+    timings = time_runs(lambda: train_single_epoch(cnn, data_loader, loss_fn, optimiser, device), epochs)
+    return summarize(timings, len(dataset)), cnn
+
+
+def benchmark_predict(metadata, repeats, from_file):
+    engine = get_inference_engine()
+    timings = []
+    for fold in metadata["fold"]:
+        if from_file:
+            timings.extend(time_runs(lambda: engine.predict_file(fold), repeats))
+        else:
+            # the in-memory path of the "Test Model" page
+            with wave.open(fold, "rb") as wf:
+                sample_rate = wf.getframerate()
+                pcm = wf.readframes(wf.getnframes())
+            timings.extend(time_runs(lambda: engine.predict_pcm(pcm, sample_rate), repeats))
+    return summarize(timings)
+
+
+def benchmark_augment_audio(metadata, clips):
+    metadata_store = get_metadata_store()
+    timings = []
+    augmented_files = 0
+    # one extra call, because the first one also starts the process pool
+    for row in metadata.head(clips + 1).to_dict("records"):
+        last_audio_id = metadata_store.next_audio_id(row["class"]) - 1
+        start_time = time.perf_counter()
+        augmented_file_names = augment_audio(row["fold"], row["class"], row["classID"], last_audio_id)
+        timings.append(time.perf_counter() - start_time)
+        augmented_files += len(augmented_file_names)
+
+    result = summarize(timings[1:])
+    result["pool_startup_run_ms"] = timings[0] * 1000
+    result["augmented_files_per_s"] = augmented_files / len(timings) / result["mean_ms"] * 1000
+    return result
+
+
+def get_commit(project_dir):
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=project_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(benchmarks=None,
+                   speakers=BENCHMARK_SPEAKERS,
+                   clips_per_speaker=BENCHMARK_CLIPS_PER_SPEAKER,
+                   duration=BENCHMARK_CLIP_SECONDS,
+                   repeats=BENCHMARK_REPEATS,
+                   epochs=BENCHMARK_EPOCHS,
+                   augmented_clips=BENCHMARK_AUGMENTED_CLIPS,
+                   num_workers=0,
+                   device="cpu",
+                   work_dir=None):
+    """
+    Generate a synthetic dataset and benchmark the audio pipeline on it.
+
+    All paths of the app are relative to the working directory, so the benchmark changes into
+    work_dir (a new temporary directory by default) and never touches the real dataset or model.
+
+    Returns:
+    dict: Environment, configuration and one result per benchmark, see summarize.
+    """
+    benchmarks = benchmarks or BENCHMARKS
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # worker processes must still find the project after the working directory changes
+    sys.path.insert(0, project_dir)
+    work_dir = work_dir or tempfile.mkdtemp(prefix="voice-classifier-benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+
+    torch.manual_seed(BENCHMARK_SEED)
+    metadata = generate_dataset(speakers, clips_per_speaker, duration)
+
+    results = {}
+    if "dataset_getitem" in benchmarks:
+        results["dataset_getitem"] = benchmark_dataset_getitem(metadata, repeats)
+    if "dataset_getitem_cached" in benchmarks:
+        feature_cache = FeatureCache(os.path.join(resource_path(FEATURE_CACHE_DIR), "mel"),
+                                     sample_rate=SAMPLE_RATE,
+                                     num_samples=NUM_SAMPLES,
+                                     window="voiced",
+                                     n_fft=N_FFT,
+                                     hop_length=HOP_LENGTH,
+                                     n_mels=N_MELS)
+        results["dataset_getitem_cached"] = benchmark_dataset_getitem(metadata, repeats, feature_cache)
+    if "mel_transform" in benchmarks:
+        results["mel_transform"] = benchmark_mel_transform(metadata, repeats)
+
+    if {"train_epoch", "predict_pcm", "predict_file"} & set(benchmarks):
+        results["train_epoch"], cnn = benchmark_train_epoch(metadata, epochs, num_workers, device)
+        # the predictions run on the model trained above
+        torch.save(cnn.state_dict(), get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME))
+        if "train_epoch" not in benchmarks:
+            del results["train_epoch"]
+    if "predict_pcm" in benchmarks:
+        results["predict_pcm"] = benchmark_predict(metadata, repeats, from_file=False)
+    if "predict_file" in benchmarks:
+        results["predict_file"] = benchmark_predict(metadata, repeats, from_file=True)
+
+    # last, because it enrolls more clips
+    if "augment_audio" in benchmarks:
+        results["augment_audio"] = benchmark_augment_audio(metadata, augmented_clips)
+
+    return {
+        "commit": get_commit(project_dir),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "device": device
+        },
+        "config": {
+            "seed": BENCHMARK_SEED,
+            "speakers": speakers,
+            "clips_per_speaker": clips_per_speaker,
+            "clip_seconds": duration,
+            "repeats": repeats,
+            "epochs": epochs,
+            "augmented_clips": augmented_clips,
+            "num_workers": num_workers,
+            "work_dir": work_dir
+        },
+        "results": results,
+        # per-stage timings, recorded when metrics are enabled
+        "stages": metrics.snapshot() if metrics.is_enabled() else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the audio pipeline on synthetic speaker recordings.")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help=f"Benchmarks to run, default all of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--speakers", type=int, default=BENCHMARK_SPEAKERS)
+    parser.add_argument("--clips-per-speaker", type=int, default=BENCHMARK_CLIPS_PER_SPEAKER)
+    parser.add_argument("--clip-seconds", type=float, default=BENCHMARK_CLIP_SECONDS)
+    parser.add_argument("--repeats", type=int, default=BENCHMARK_REPEATS, help="Timed runs per clip")
+    parser.add_argument("--epochs", type=int, default=BENCHMARK_EPOCHS, help="Timed training epochs")
+    parser.add_argument("--augmented-clips", type=int, default=BENCHMARK_AUGMENTED_CLIPS,
+                        help="Timed augment_audio calls, at least 1")
+    parser.add_argument("--num-workers", type=int, default=0,
+                        help=f"DataLoader worker processes for the training epoch (training uses {NUM_WORKERS})")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Also record and report the per-stage timings of ml_scripts.metrics")
+    parser.add_argument("--work-dir", help="Directory of the synthetic dataset, default a new temporary directory")
+    args = parser.parse_args()
+    unknown_benchmarks = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown_benchmarks:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown_benchmarks))}")
+    if args.augmented_clips < 1:
+        parser.error("--augmented-clips must be at least 1")
+    output = os.path.abspath(args.output) if args.output else None
+    if args.metrics:
+        metrics.enable()
+
+    # progress output of the pipeline, e.g. the training loss, must not end up in the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmarks(args.benchmarks,
+                                speakers=args.speakers,
+                                clips_per_speaker=args.clips_per_speaker,
+                                duration=args.clip_seconds,
+                                repeats=args.repeats,
+                                epochs=args.epochs,
+                                augmented_clips=args.augmented_clips,
+                                num_workers=args.num_workers,
+                                device=args.device,
+                                work_dir=args.work_dir)
+
+    report_json = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as output_file:
+            output_file.write(report_json)
+        print(f"Benchmark report written to {output}")
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
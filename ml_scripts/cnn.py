@@ -1,11 +1,14 @@
+import torch
 from torch import nn
 from torchsummary import summary
 
+NUM_CLASSES = 10
+
 
 # CNN architecture is taken from
 # https://github.com/musikalkemist/pytorchforaudio/blob/main/10%20Predictions%20with%20sound%20classifier/cnn.py
 class CNNNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, num_classes=NUM_CLASSES):
         super().__init__()
         # 4 conv blocks / flatten / linear / softmax
         self.conv1 = nn.Sequential(
@@ -53,7 +56,7 @@ class CNNNetwork(nn.Module):
             nn.MaxPool2d(kernel_size=2)
         )
         self.flatten = nn.Flatten()
-        self.linear = nn.Linear(128 * 5 * 4, 10)
+        self.linear = nn.Linear(128 * 5 * 4, num_classes)
         self.softmax = nn.Softmax(dim=1)
 
     def forward(self, input_data):
@@ -66,6 +69,30 @@ class CNNNetwork(nn.Module):
         predictions = self.softmax(logits)
         return predictions
 
+    @property
+    def num_classes(self):
+        return self.linear.out_features
+
+    def expand_output(self, num_classes):
+        """
+        Grow the output layer to num_classes units, keeping the weights of the existing ones.
+        New units start from small random weights, so they can be learned by fine-tuning.
+        """
+        if num_classes <= self.num_classes:
+            return
+
+        old_linear = self.linear
+        new_linear = nn.Linear(old_linear.in_features, num_classes).to(old_linear.weight.device)
+        with torch.no_grad():
+            new_linear.weight[:old_linear.out_features] = old_linear.weight
+            new_linear.bias[:old_linear.out_features] = old_linear.bias
+        self.linear = new_linear
+
+
+def num_classes_in_state_dict(state_dict):
+    """ Number of output units of a saved CNNNetwork """
+    return state_dict["linear.weight"].shape[0]
+
 
 if __name__ == "__main__":
     cnn = CNNNetwork()
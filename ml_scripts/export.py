@@ -0,0 +1,186 @@
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from ml_scripts.inference import load_model, load_model_artifact, get_artifact_path
+from ml_scripts.train import create_dataset
+from ml_scripts.utils import *
+
+EXPORT_BATCH_SIZE = 32
+CALIBRATION_BATCHES = 8
+LATENCY_RUNS = 100
+
+
+def load_feature_batches(batch_size=EXPORT_BATCH_SIZE, max_batches=None):
+    """
+    Mel spectrograms and labels of the enrolled recordings, without augmentation.
+
+    Returns:
+    list: (features, labels) batches.
+    """
+    dataset = create_dataset(AUGMENTATION_MODE_MATERIALIZED)
+    if len(dataset) == 0:
+        raise ValueError("There are no enrolled recordings to export or evaluate the model with")
+
+    batches = []
+    for features, labels in DataLoader(dataset, batch_size=batch_size):
+        batches.append((features, labels))
+        if max_batches is not None and len(batches) >= max_batches:
+            break
+    return batches
+
+
+def quantize_model(model, calibration_batches):
+    """
+    Statically quantize a CNNNetwork to int8 with FX graph mode quantization.
+    Activation ranges are calibrated on calibration_batches.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    example_inputs = (calibration_batches[0][0],)
+    prepared = prepare_fx(copy.deepcopy(model).eval(), qconfig_mapping, example_inputs)
+
+    with torch.no_grad():
+        for features, _ in calibration_batches:
+            prepared(features)
+
+    return convert_fx(prepared)
+
+
+def export_models(model_path=None, export_onnx=True):
+    """
+    Export feedforwardnet.pth as TorchScript, as int8 quantized TorchScript and as ONNX.
+
+    Parameters:
+    - model_path (str): Path of feedforwardnet.pth.
+    - export_onnx (bool): Also export ONNX. Skipped with a message if the export fails,
+      e.g. because the onnx package is not installed.
+
+    Returns:
+    dict: Artifact name -> path of the written file.
+    """
+    model_path = model_path or get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME)
+    model = load_model(model_path, "cpu")
+    calibration_batches = load_feature_batches(max_batches=CALIBRATION_BATCHES)
+    example_input = calibration_batches[0][0]
+
+    exported = {}
+    with torch.no_grad():
+        torchscript_path = get_artifact_path(model_path, MODEL_ARTIFACT_TORCHSCRIPT)
+        torch.jit.trace(model, example_input).save(torchscript_path)
+        exported[MODEL_ARTIFACT_TORCHSCRIPT] = torchscript_path
+
+        quantized_path = get_artifact_path(model_path, MODEL_ARTIFACT_QUANTIZED)
+        quantized_model = quantize_model(model, calibration_batches)
+        torch.jit.trace(quantized_model, example_input).save(quantized_path)
+        exported[MODEL_ARTIFACT_QUANTIZED] = quantized_path
+
+    if export_onnx:
+        onnx_path = get_artifact_path(model_path, MODEL_ARTIFACT_ONNX)
+        try:
+            torch.onnx.export(model, example_input, onnx_path,
+                              input_names=["features"],
+                              output_names=["probabilities"],
+                              dynamic_axes={"features": {0: "batch"}, "probabilities": {0: "batch"}})
+            exported[MODEL_ARTIFACT_ONNX] = onnx_path
+        except Exception as e:
+            print(f"Skipping the ONNX export: {e}")
+
+    return exported
+
+
+def _measure_latency(model, features, runs=LATENCY_RUNS):
+    timings = []
+    with torch.no_grad():
+        # warm-up, e.g. for the TorchScript profiling executor
+        for _ in range(3):
+            model(features)
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            model(features)
+            timings.append(time.perf_counter() - start_time)
+    return np.percentile(timings, 50) * 1000, np.percentile(timings, 99) * 1000
+
+
+def compare_artifacts(model_path=None, artifacts=None):
+    """
+    Compare the accuracy and CPU latency of the eager model and its exports on the current dataset.
+
+    Parameters:
+    - model_path (str): Path of feedforwardnet.pth.
+    - artifacts (list): Artifacts to compare, default all of them. Missing exports are skipped.
+
+    Returns:
+    list: One dict per artifact with accuracy, agreement with the eager model,
+    p50/p99 single-clip latency in ms and batched throughput in clips per second.
+    """
+    model_path = model_path or get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME)
+    artifacts = artifacts or list(MODEL_ARTIFACT_NAMES)
+    batches = load_feature_batches()
+    single_clip = batches[0][0][:1]
+
+    results = []
+    eager_predictions = None
+    for artifact in artifacts:
+        if not os.path.isfile(get_artifact_path(model_path, artifact)):
+            print(f"Skipping {artifact}: not exported")
+            continue
+        try:
+            model = load_model_artifact(model_path, artifact, "cpu")
+        except ImportError as e:
+            print(f"Skipping {artifact}: {e}")
+            continue
+
+        predictions = []
+        start_time = time.perf_counter()
+        with torch.no_grad():
+            for features, _ in batches:
+                predictions.append(model(features).argmax(1))
+        elapsed = time.perf_counter() - start_time
+        predictions = torch.cat(predictions)
+        labels = torch.cat([labels for _, labels in batches])
+
+        if artifact == MODEL_ARTIFACT_EAGER:
+            eager_predictions = predictions
+        p50, p99 = _measure_latency(model, single_clip)
+
+        results.append({
+            "artifact": artifact,
+            "accuracy": (predictions == labels).float().mean().item(),
+            "agreement_with_eager": (predictions == eager_predictions).float().mean().item()
+            if eager_predictions is not None else None,
+            "latency_p50_ms": p50,
+            "latency_p99_ms": p99,
+            "clips_per_second": len(labels) / elapsed if elapsed > 0 else 0.0
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the trained model for fast CPU inference.")
+    parser.add_argument("--no-onnx", action="store_true", help="Skip the ONNX export")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare accuracy and latency of all artifacts on the current dataset")
+    args = parser.parse_args()
+
+    for artifact, path in export_models(export_onnx=not args.no_onnx).items():
+        print(f"Exported {artifact} model to {path}")
+
+    if args.compare:
+        print(f"{'artifact':<12} {'accuracy':>9} {'agreement':>10} {'p50 ms':>8} {'p99 ms':>8} {'clips/s':>9}")
+        for result in compare_artifacts():
+            agreement = result["agreement_with_eager"]
+            agreement = f"{agreement:.3f}" if agreement is not None else "-"
+            print(f"{result['artifact']:<12} {result['accuracy']:>9.3f} {agreement:>10} "
+                  f"{result['latency_p50_ms']:>8.2f} {result['latency_p99_ms']:>8.2f} "
+                  f"{result['clips_per_second']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
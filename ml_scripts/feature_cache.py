@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import shutil
+
+import torch
+
+
+class FeatureCache:
+    """
+    Persistent on-disk cache for mel-spectrogram features.
+
+    Each entry is keyed by the SHA-1 of the audio file content. Entries live in a
+    sub-directory named after a fingerprint of the transform parameters, so changing
+    SAMPLE_RATE, NUM_SAMPLES, n_fft, hop_length or n_mels starts a fresh cache and the
+    outdated one is removed. Every kind of features (waveforms, mel spectrograms) needs its
+    own cache_dir, otherwise the caches would remove each other.
+    """
+
+    def __init__(self, cache_dir, **params):
+        """
+        Parameters:
+        - cache_dir (str): Root directory of the cache, used by no other kind of features.
+        - params: Transform parameters that the cached features depend on.
+        """
+        fingerprint = json.dumps(params, sort_keys=True)
+        self.fingerprint = hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+        self.root_dir = cache_dir
+        self.cache_dir = os.path.join(cache_dir, self.fingerprint)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._prune_stale_entries()
+
+        # (path, size, mtime) -> content hash, so unchanged files are hashed only once
+        self._content_hashes = {}
+
+    def load(self, audio_path):
+        """
+        Return the cached features of an audio file or None on a cache miss.
+        """
+        entry_path = self._entry_path(audio_path)
+        if not os.path.isfile(entry_path):
+            return None
+        try:
+            return torch.load(entry_path)
+        except (OSError, RuntimeError, EOFError):
+            # A partially written or corrupted entry is treated as a miss
+            return None
+
+    def store(self, audio_path, features):
+        """
+        Save the features of an audio file. The entry is written to a temporary file first,
+        so concurrent readers never see a half-written tensor.
+        """
+        entry_path = self._entry_path(audio_path)
+        # the directory is gone if the cache was deleted while it was in use
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        torch.save(features.detach().cpu(), tmp_path)
+        os.replace(tmp_path, entry_path)
+
+    def _entry_path(self, audio_path):
+        return os.path.join(self.cache_dir, f"{self._content_hash(audio_path)}.pt")
+
+    def _content_hash(self, audio_path):
+        stat = os.stat(audio_path)
+        key = (audio_path, stat.st_size, stat.st_mtime_ns)
+        content_hash = self._content_hashes.get(key)
+        if content_hash is None:
+            sha1 = hashlib.sha1()
+            with open(audio_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    sha1.update(chunk)
+            content_hash = sha1.hexdigest()
+            self._content_hashes[key] = content_hash
+        return content_hash
+
+    def _prune_stale_entries(self):
+        # Entries computed with other transform parameters can never be hit again
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            if name != self.fingerprint and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
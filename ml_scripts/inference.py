@@ -1,84 +1,305 @@
+import threading
 import time
 
-import pandas as pd
+import numpy as np
 import torch
 import torchaudio
-from ml_scripts.cnn import CNNNetwork
+from ml_scripts import metrics
+from ml_scripts.cnn import CNNNetwork, num_classes_in_state_dict
+from ml_scripts.metadata_store import get_metadata_store
+from ml_scripts.preprocessing import prepare_signal, extract_features_batch, mix_down_if_necessary, \
+    resample_if_necessary, split_into_windows
 from ml_scripts.utils import *
 
 
-def _resample_if_necessary(signal, sr, device):
-    if sr != SAMPLE_RATE:
-        resampler = torchaudio.transforms.Resample(sr, SAMPLE_RATE).to(device)
-        signal = resampler(signal)
-    return signal
+def pcm_to_signal(pcm):
+    """
+    Convert mono 16-bit PCM audio to a (1, samples) float tensor in [-1, 1].
 
+    Parameters:
+    - pcm (bytes | np.ndarray): Raw int16 PCM bytes, or an int16 / float NumPy buffer.
+    """
+    if isinstance(pcm, np.ndarray):
+        samples = pcm
+    else:
+        # np.frombuffer views the bytes without copying them
+        samples = np.frombuffer(pcm, dtype=np.int16)
 
-def _mix_down_if_necessary(signal):
-    if signal.shape[0] > 1:
-        signal = torch.mean(signal, dim=0, keepdim=True)
-    return signal
+    if samples.dtype == np.int16:
+        # the only copy: int16 -> float32, scaled in the same pass
+        samples = np.multiply(samples, 1 / 32768, dtype=np.float32)
+    elif samples.dtype != np.float32:
+        samples = samples.astype(np.float32)
 
+    return torch.from_numpy(samples).reshape(1, -1)
 
-def _cut_if_necessary(signal, num_samples):
-    if signal.shape[1] > num_samples:
-        signal = signal[:, :num_samples]
-    return signal
 
+def load_model(model_path, device):
+    state_dict = torch.load(model_path, map_location=device)
+    cnn = CNNNetwork(num_classes_in_state_dict(state_dict)).to(device)
+    cnn.load_state_dict(state_dict)
+    cnn.eval()
+    return cnn
 
-def _right_pad_if_necessary(signal, num_samples):
-    length_signal = signal.shape[1]
-    if length_signal < num_samples:
-        num_missing_samples = num_samples - length_signal
-        last_dim_padding = (0, num_missing_samples)
-        signal = torch.nn.functional.pad(signal, last_dim_padding)
-    return signal
 
+def aggregate_window_probabilities(window_probabilities, aggregation=UTTERANCE_AGGREGATION):
+    """
+    Combine the (windows, classes) probabilities of the windows of one utterance.
 
-def find_unique_classes(csv_file_path):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(csv_file_path)
+    Parameters:
+    - window_probabilities (torch.Tensor): Probabilities of every window.
+    - aggregation (str): UTTERANCE_AGGREGATION_MEAN or UTTERANCE_AGGREGATION_LOG.
 
-    # Extract unique values from the "class" column
-    unique_classes = df['class'].unique()
+    Returns:
+    torch.Tensor: Class probabilities of the utterance, summing to 1.
+    """
+    if aggregation == UTTERANCE_AGGREGATION_LOG:
+        # mean instead of sum of the log probabilities, so the result does not get sharper with length
+        log_probabilities = torch.log(window_probabilities.clamp_min(1e-12)).mean(dim=0)
+        return torch.softmax(log_probabilities, dim=0)
+    probabilities = window_probabilities.mean(dim=0)
+    return probabilities / probabilities.sum()
 
-    return unique_classes
 
+class OnnxModel:
+    """
+    Runs an exported ONNX model with onnxruntime behind the same call interface as CNNNetwork.
+    """
 
-def load_model(model_path, device):
-    cnn = CNNNetwork().to(device)
-    cnn.load_state_dict(torch.load(model_path))
-    cnn.eval()
-    return cnn
+    def __init__(self, model_path):
+        import onnxruntime
 
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
 
-def predict(test_widgets, test_audio_file):
-    device = "cpu"
+    def __call__(self, features):
+        outputs = self.session.run(None, {self.input_name: features.cpu().numpy()})
+        return torch.from_numpy(outputs[0])
 
-    test_widgets.test_record_btn.configure(state="disabled")
-    test_widgets.test_stop_btn.configure(state="disabled")
 
-    class_mapping = find_unique_classes(get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME))
+def get_artifact_path(model_path, artifact):
+    """ Path of an exported artifact, which lives next to feedforwardnet.pth """
+    return os.path.join(os.path.dirname(model_path), MODEL_ARTIFACT_NAMES[artifact])
+
+
+def load_model_artifact(model_path, artifact, device):
+    """
+    Load the eager model, its TorchScript or int8 quantized TorchScript export or its ONNX export.
+    """
+    artifact_path = get_artifact_path(model_path, artifact)
+    if artifact == MODEL_ARTIFACT_EAGER:
+        return load_model(artifact_path, device)
+    if artifact == MODEL_ARTIFACT_ONNX:
+        return OnnxModel(artifact_path)
+
+    model = torch.jit.load(artifact_path, map_location=device)
+    model.eval()
+    return model
+
+
+class InferenceEngine:
+    """
+    Long-lived inference state: the model, the class mapping and the preprocessing modules
+    are kept in memory and only reloaded when the model file or the metadata changes.
+
+    artifact selects the eager model or one of its exports (see ml_scripts.export). An export
+    that is missing or older than feedforwardnet.pth is ignored in favour of the eager model.
+
+    prediction_mode selects whether a recording is classified by its most voiced NUM_SAMPLES
+    window or by all of its overlapping windows (see PREDICTION_MODE in utils).
+    """
+
+    def __init__(self, model_path, metadata_store, device="cpu", artifact=MODEL_ARTIFACT,
+                 prediction_mode=PREDICTION_MODE, aggregation=UTTERANCE_AGGREGATION):
+        self.model_path = model_path
+        self.metadata_store = metadata_store
+        self.device = device
+        self.artifact = artifact
+        self.prediction_mode = prediction_mode
+        self.aggregation = aggregation
+
+        self.model = None
+        self.class_mapping = None
+        self.transformation = get_mel_spectrogram().to(device)
+
+        self._model_mtime = None
+        self._metadata_version = None
+        self._lock = threading.Lock()
+
+    def reload_if_changed(self):
+        """
+        Reload the model and the class mapping if their files were modified since the last load.
+        """
+        with self._lock:
+            self._reload_if_changed()
+
+    def _reload_if_changed(self):
+        # the caller holds self._lock
+        artifact = self._select_artifact()
+        model_mtime = (artifact, os.stat(get_artifact_path(self.model_path, artifact)).st_mtime_ns)
+        if model_mtime != self._model_mtime:
+            self.model = load_model_artifact(self.model_path, artifact, self.device)
+            self._model_mtime = model_mtime
+
+        metadata_version = self.metadata_store.version
+        if metadata_version != self._metadata_version:
+            self.class_mapping = self.metadata_store.classes()
+            self._metadata_version = metadata_version
+
+    def _select_artifact(self):
+        if self.artifact == MODEL_ARTIFACT_EAGER:
+            return MODEL_ARTIFACT_EAGER
+
+        artifact_path = get_artifact_path(self.model_path, self.artifact)
+        if os.path.isfile(artifact_path) and os.stat(artifact_path).st_mtime_ns >= os.stat(self.model_path).st_mtime_ns:
+            return self.artifact
+        return MODEL_ARTIFACT_EAGER
+
+    def extract_features(self, signal, sr):
+        """
+        Turn a (channels, samples) waveform into a (1, n_mels, frames) mel spectrogram.
+        """
+        with metrics.stage("predict.preprocess"):
+            signal = prepare_signal(signal.to(self.device), sr)
+        with metrics.stage("predict.mel"):
+            return self.transformation(signal)
 
-    model = load_model(get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME), device)
+    def extract_utterance_features(self, signal, sr, hop_samples=UTTERANCE_HOP_SAMPLES):
+        """
+        Turn a (channels, samples) waveform of any length into the (windows, 1, n_mels, frames)
+        mel spectrograms of its overlapping windows, computed with one vectorized call.
+        """
+        with metrics.stage("predict.preprocess"):
+            signal = resample_if_necessary(mix_down_if_necessary(signal.to(self.device)), sr)
+            windows = split_into_windows(signal, NUM_SAMPLES, hop_samples)
+        with metrics.stage("predict.mel"):
+            return self.transformation(windows)
 
-    transformation = mel_spectrogram.to(device)
+    def extract_features_batch(self, signals):
+        """
+        Turn a list of (signal, sr) pairs into a (batch, 1, n_mels, frames) tensor of their most voiced windows.
+        """
+        return extract_features_batch(signals, self.transformation, device=self.device)
 
-    signal, sr = torchaudio.load(test_audio_file)
-    signal = signal.to(device)
-    signal = _resample_if_necessary(signal, sr, device)
-    signal = _mix_down_if_necessary(signal)
-    signal = _cut_if_necessary(signal, NUM_SAMPLES)
-    signal = _right_pad_if_necessary(signal, NUM_SAMPLES)
-    signal = transformation(signal)
+    def extract_signal_features(self, signal, sr):
+        """
+        Turn a (channels, samples) waveform into the (windows, 1, n_mels, frames) mel spectrograms
+        the prediction mode classifies it by: all of its windows, or only the most voiced one.
+        """
+        if self.prediction_mode == PREDICTION_MODE_UTTERANCE:
+            return self.extract_utterance_features(signal, sr)
+        return self.extract_features(signal, sr).unsqueeze(0)
 
-    signal.unsqueeze_(0)
+    def classify_features(self, features):
+        """
+        Run one forward pass over a (batch, 1, n_mels, frames) tensor.
+
+        Returns:
+        tuple: Class probabilities of shape (batch, number of known classes), and the class names
+        in their order, read together with the model so a concurrent reload cannot mix them up.
+        """
+        with self._lock, metrics.stage("predict.reload"):
+            self._reload_if_changed()
+            model = self.model
+            class_mapping = self.class_mapping
+
+        with torch.no_grad(), metrics.stage("predict.forward"):
+            predictions = model(features.to(self.device))
+
+        # the output layer can be larger than the number of enrolled speakers
+        return predictions[:, :len(class_mapping)], class_mapping
+
+    def classify_feature_groups(self, feature_groups):
+        """
+        Classify several recordings in one forward pass.
+
+        Parameters:
+        - feature_groups (list): (windows, 1, n_mels, frames) tensors from extract_signal_features.
+
+        Returns:
+        tuple: Class probabilities of shape (recordings, number of known classes), with the windows
+        of every recording aggregated in utterance mode, and the class names in their order.
+        """
+        window_probabilities, class_mapping = self.classify_features(torch.cat(feature_groups))
+        if self.prediction_mode != PREDICTION_MODE_UTTERANCE:
+            return window_probabilities, class_mapping
+
+        probabilities = [aggregate_window_probabilities(recording_probabilities, self.aggregation)
+                         for recording_probabilities in
+                         window_probabilities.split([len(features) for features in feature_groups])]
+        return torch.stack(probabilities), class_mapping
+
+    def classify_signals(self, signals):
+        """
+        Classify a list of (signal, sr) pairs in one forward pass, according to the prediction mode.
+
+        Returns:
+        tuple: Class probabilities of shape (signals, number of known classes) and the class names in their order.
+        """
+        if self.prediction_mode == PREDICTION_MODE_UTTERANCE:
+            return self.classify_feature_groups([self.extract_signal_features(signal, sr) for signal, sr in signals])
+        # one window per signal, preprocessed with a single vectorized call per sample rate
+        return self.classify_features(self.extract_features_batch(signals))
+
+    def predict_file(self, audio_file):
+        """
+        Predict the speaker of an audio file.
+
+        Returns:
+        tuple: Predicted class name and the probabilities of all known classes.
+        """
+        with metrics.stage("predict.decode"):
+            signal, sr = torchaudio.load(audio_file)
+        return self.predict_signal(signal, sr)
+
+    def predict_pcm(self, pcm, sample_rate):
+        """
+        Predict the speaker of in-memory mono 16-bit PCM audio, without any disk round trip.
+
+        Returns:
+        tuple: Predicted class name and the probabilities of all known classes.
+        """
+        with metrics.stage("predict.decode"):
+            signal = pcm_to_signal(pcm)
+        return self.predict_signal(signal, sample_rate)
+
+    def predict_signal(self, signal, sr):
+        with metrics.stage("predict.total"):
+            # in utterance mode all windows of the recording go through a single forward pass
+            probabilities, class_mapping = self.classify_feature_groups([self.extract_signal_features(signal, sr)])
+        return class_mapping[probabilities[0].argmax(0)], probabilities[0]
+
+
+_inference_engine = None
+_inference_engine_lock = threading.Lock()
+
+
+def get_inference_engine():
+    """ Return the process-wide inference engine, creating it on first use """
+    global _inference_engine
+    with _inference_engine_lock:
+        if _inference_engine is None:
+            _inference_engine = InferenceEngine(get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME),
+                                                get_metadata_store())
+        return _inference_engine
+
+
+def predict(test_widgets, test_audio, sample_rate=None):
+    """
+    Predict the speaker of a test recording and show the result.
+
+    Parameters:
+    - test_widgets (TestModelWidgets): Widgets of the "Test Model" page.
+    - test_audio (str | bytes | np.ndarray): Path of an audio file, or in-memory 16-bit PCM audio.
+    - sample_rate (int): Sample rate of in-memory audio.
+    """
+    test_widgets.test_record_btn.configure(state="disabled")
+    test_widgets.test_stop_btn.configure(state="disabled")
 
-    with torch.no_grad():
-        predictions = model(signal)
-        # Tensor (1, 10) -> [ [0.1, 0.01, ..., 0.6] ]
-        predicted_index = predictions[0].argmax(0)
-        predicted = class_mapping[predicted_index]
+    if isinstance(test_audio, str):
+        predicted, _ = get_inference_engine().predict_file(test_audio)
+    else:
+        predicted, _ = get_inference_engine().predict_pcm(test_audio, sample_rate)
 
     test_widgets.test_record_btn.configure(state="normal")
     test_widgets.test_stop_btn.configure(state="normal")
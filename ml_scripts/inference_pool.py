@@ -0,0 +1,232 @@
+import argparse
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.multiprocessing
+import torchaudio
+from ml_scripts.batch_inference import find_audio_files
+from ml_scripts.inference import InferenceEngine, pcm_to_signal
+from ml_scripts.metadata_store import get_metadata_store
+from ml_scripts.utils import *
+
+INFERENCE_POOL_WORKERS = os.cpu_count() or 1
+# How often the dispatcher checks that the workers are still alive while it waits for results
+WORKER_CHECK_INTERVAL_SECONDS = 1.0
+
+
+def _worker_main(model_path, num_threads, tasks, results):
+    """
+    Worker process: load the model once, then classify tasks until None is received.
+    """
+    # every worker gets its own share of the cores instead of all of them
+    torch.set_num_threads(num_threads)
+    engine = InferenceEngine(model_path, get_metadata_store())
+    try:
+        engine.reload_if_changed()
+    except Exception as e:
+        print(f"Inference worker could not load {model_path}: {e}")
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+
+        request_id, audio, sr = task
+        try:
+            if isinstance(audio, str):
+                # decoding runs in the worker, outside the dispatcher's interpreter
+                signal, sr = torchaudio.load(audio)
+            else:
+                signal = audio
+            predicted, probabilities = engine.predict_signal(signal, sr)
+            results.put((request_id, (predicted, probabilities), None))
+        except Exception as e:
+            results.put((request_id, None, str(e)))
+
+
+class InferencePool:
+    """
+    Classifies audio in num_workers processes, so decoding, preprocessing and the forward pass
+    of different clips run on different cores instead of sharing one interpreter and its GIL.
+
+    Waveforms are handed to the workers through torch.multiprocessing queues, which move tensors
+    to shared memory and only send a handle, so the audio itself is never pickled or copied
+    through a pipe. Audio files are decoded by the workers.
+
+    If a worker dies, e.g. because it ran out of memory, the pool is broken: the other workers
+    are stopped, every outstanding future fails with a RuntimeError and no new work is accepted.
+    """
+
+    def __init__(self, num_workers=INFERENCE_POOL_WORKERS, threads_per_worker=None, model_path=None):
+        """
+        Parameters:
+        - num_workers (int): Number of worker processes.
+        - threads_per_worker (int): torch threads per worker, default the cores divided by the workers.
+        - model_path (str): Path of feedforwardnet.pth. Each worker loads it once.
+        """
+        model_path = model_path or get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME)
+        threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+
+        # spawned workers do not inherit the dispatcher's torch thread pools or locks
+        context = torch.multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [context.Process(target=_worker_main,
+                                         args=(model_path, threads_per_worker, self._tasks, self._results),
+                                         daemon=True)
+                         for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+        # request id -> (future, waveform), the waveform is kept alive until a worker is done with it
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closing = False
+        self._broken = False
+        self._request_ids = itertools.count()
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+
+    def submit_file(self, audio_file):
+        """
+        Classify an audio file.
+
+        Returns:
+        concurrent.futures.Future: Resolves to the predicted class and the probabilities of all known classes.
+        """
+        return self._submit(audio_file, None)
+
+    def submit_signal(self, signal, sr):
+        """
+        Classify a (channels, samples) waveform.
+
+        Returns:
+        concurrent.futures.Future: Resolves to the predicted class and the probabilities of all known classes.
+        """
+        return self._submit(signal.contiguous().share_memory_(), sr)
+
+    def submit_pcm(self, pcm, sample_rate):
+        """
+        Classify mono 16-bit PCM audio.
+
+        Returns:
+        concurrent.futures.Future: Resolves to the predicted class and the probabilities of all known classes.
+        """
+        return self.submit_signal(pcm_to_signal(pcm), sample_rate)
+
+    def map_files(self, audio_files):
+        """
+        Classify audio files on all workers.
+
+        Returns:
+        generator: (audio_file, predicted class or None, probabilities or None, error or None) tuples,
+        in the order of audio_files.
+        """
+        futures = [self.submit_file(audio_file) for audio_file in audio_files]
+        for audio_file, future in zip(audio_files, futures):
+            try:
+                predicted, probabilities = future.result()
+                yield audio_file, predicted, probabilities, None
+            except Exception as e:
+                yield audio_file, None, None, str(e)
+
+    def close(self):
+        """ Stop the workers after the queued tasks are done """
+        self._closing = True
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._results.put(None)
+        self._collector.join()
+        # tasks of a worker that died while the pool was closing are never answered
+        self._fail_pending("An inference worker exited before finishing its tasks")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _submit(self, audio, sr):
+        future = Future()
+        with self._lock:
+            if self._broken:
+                raise RuntimeError("The inference pool is broken, an inference worker died")
+            request_id = next(self._request_ids)
+            self._pending[request_id] = (future, audio)
+        self._tasks.put((request_id, audio, sr))
+        return future
+
+    def _collect_results(self):
+        while True:
+            try:
+                result = self._results.get(timeout=WORKER_CHECK_INTERVAL_SECONDS)
+            except queue.Empty:
+                if not self._closing and not all(worker.is_alive() for worker in self._workers):
+                    self._break()
+                    return
+                continue
+            if result is None:
+                return
+            self._resolve(result)
+
+    def _resolve(self, result):
+        request_id, prediction, error = result
+        with self._lock:
+            future, _ = self._pending.pop(request_id, (None, None))
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(prediction)
+
+    def _break(self):
+        exit_codes = [worker.exitcode for worker in self._workers if not worker.is_alive()]
+        with self._lock:
+            self._broken = True
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+
+        # results that arrived before the workers were stopped are still delivered
+        while True:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if result is not None:
+                self._resolve(result)
+        self._fail_pending(f"An inference worker died with exit code {exit_codes[0]}")
+
+    def _fail_pending(self, message):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(RuntimeError(message))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a directory of audio files with a pool of processes.")
+    parser.add_argument("audio_dir", help="Directory that is searched recursively for audio files")
+    parser.add_argument("--workers", type=int, default=INFERENCE_POOL_WORKERS, help="Number of worker processes")
+    parser.add_argument("--threads", type=int, help="torch threads per worker, default the cores divided by the workers")
+    args = parser.parse_args()
+
+    audio_files = find_audio_files(args.audio_dir)
+    start_time = time.perf_counter()
+    with InferencePool(args.workers, args.threads) as pool:
+        for audio_file, predicted, _, error in pool.map_files(audio_files):
+            print(f"{audio_file}\t{predicted if error is None else f'error: {error}'}")
+    elapsed = time.perf_counter() - start_time
+    print(f"Classified {len(audio_files)} files in {elapsed:.1f} s "
+          f"({len(audio_files) / elapsed if elapsed > 0 else 0.0:.1f} files/s) with {args.workers} workers")
+
+
+if __name__ == "__main__":
+    main()
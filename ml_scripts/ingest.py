@@ -0,0 +1,115 @@
+import argparse
+import shutil
+import wave
+
+import numpy as np
+import torch
+import torchaudio
+from ml_scripts.metadata_store import get_metadata_store
+from ml_scripts.preprocessing import mix_down_if_necessary, resample_if_necessary
+from ml_scripts.vad import trim_recording
+from ml_scripts.utils import *
+
+
+def _signal_to_pcm(signal):
+    return (signal.clamp(-1.0, 1.0) * 32767).round().to(torch.int16).numpy().tobytes()
+
+
+def canonicalize_pcm(pcm, sample_rate):
+    """
+    Resample mono 16-bit PCM audio to SAMPLE_RATE.
+
+    Returns:
+    bytes: 16-bit PCM audio at SAMPLE_RATE, pcm itself if it already is.
+    """
+    if sample_rate == SAMPLE_RATE:
+        return pcm
+    signal = torch.from_numpy(np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768).unsqueeze(0)
+    return _signal_to_pcm(resample_if_necessary(signal, sample_rate, SAMPLE_RATE))
+
+
+def write_wav(file_path, pcm, sample_rate=SAMPLE_RATE):
+    """ Write mono 16-bit PCM audio as a WAV file """
+    with wave.open(file_path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+
+
+def ingest_recording(pcm, sample_rate, file_path):
+    """
+    Store a new training recording in the canonical format: mono 16-bit PCM at SAMPLE_RATE,
+    without its leading and trailing silence. It is resampled here once, so training never
+    resamples it again. The window the model sees is chosen when the clip is loaded.
+
+    Parameters:
+    - pcm (bytes): Recorded mono 16-bit PCM audio.
+    - sample_rate (int): Sample rate of the recording.
+    - file_path (str): Destination WAV file.
+    """
+    pcm = trim_recording(canonicalize_pcm(pcm, sample_rate), SAMPLE_RATE)
+    write_wav(file_path, pcm)
+
+
+def is_canonical(file_path):
+    """ Whether an audio file is a mono 16-bit PCM WAV file at SAMPLE_RATE """
+    try:
+        with wave.open(file_path, "rb") as wf:
+            return wf.getframerate() == SAMPLE_RATE and wf.getnchannels() == 1 and wf.getsampwidth() == 2
+    except (wave.Error, EOFError):
+        # not a PCM WAV file, e.g. a float WAV file
+        return False
+
+
+def canonicalize_file(file_path):
+    """
+    Convert an audio file in place to a mono 16-bit PCM WAV file at SAMPLE_RATE.
+
+    Returns:
+    bool: True if the file was converted, False if it already was canonical.
+    """
+    if is_canonical(file_path):
+        return False
+
+    signal, sr = torchaudio.load(file_path)
+    signal = resample_if_necessary(mix_down_if_necessary(signal), sr, SAMPLE_RATE)
+
+    tmp_path = f"{file_path}.tmp"
+    write_wav(tmp_path, _signal_to_pcm(signal))
+    os.replace(tmp_path, file_path)
+    return True
+
+
+def canonicalize_dataset():
+    """
+    Convert every enrolled clip that is not canonical yet, e.g. recordings made before clips
+    were canonicalized at ingest.
+
+    Returns:
+    tuple: Number of converted clips and number of clips.
+    """
+    rows = get_metadata_store().rows()
+    converted = 0
+    for _, fold, _, _ in rows:
+        if os.path.isfile(fold) and canonicalize_file(fold):
+            converted += 1
+
+    if converted:
+        # the shard reuses packed clips by file name, so it would keep the old audio.
+        # Cached features are keyed by the file content and stay valid.
+        shutil.rmtree(resource_path(SHARD_DIR), ignore_errors=True)
+    return converted, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"Convert the enrolled clips to mono 16-bit WAV files at {SAMPLE_RATE} Hz.")
+    parser.parse_args()
+
+    converted, total = canonicalize_dataset()
+    print(f"Converted {converted} of {total} clips to mono {SAMPLE_RATE} Hz")
+
+
+if __name__ == "__main__":
+    main()
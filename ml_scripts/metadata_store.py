@@ -0,0 +1,170 @@
+import csv
+import sqlite3
+import threading
+
+from ml_scripts import metrics
+from ml_scripts.utils import *
+
+METADATA_COLUMNS = ["file_name", "fold", "classID", "class"]
+
+
+def parse_audio_id(file_name):
+    """ Return the audio id of a file named userid-username-audioid.wav """
+    return int(file_name.rsplit(".", 1)[0].rsplit("-", 1)[1])
+
+
+class MetadataStore:
+    """
+    Training metadata in SQLite, with an in-memory index of the enrolled classes.
+
+    The index answers "class id of a user", "next audio id of a user", "class list" and
+    "is any class enrolled" without touching the database. It is rebuilt only when the
+    database file has been modified by another connection, e.g. by another process.
+    """
+
+    def __init__(self, db_path, legacy_csv_path=None):
+        """
+        Parameters:
+        - db_path (str): Path of the SQLite database.
+        - legacy_csv_path (str): train_metadata.csv, imported once when the database is created.
+        """
+        self.db_path = db_path
+        is_new_database = not os.path.isfile(db_path)
+
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS recordings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_name TEXT NOT NULL UNIQUE,
+                fold TEXT NOT NULL,
+                class_id INTEGER NOT NULL,
+                class TEXT NOT NULL
+            )
+        """)
+        self._connection.commit()
+
+        # the index has to exist before the migration, which adds its rows to it
+        self._version = None
+        self._refresh_index()
+
+        if is_new_database and legacy_csv_path is not None and os.path.isfile(legacy_csv_path):
+            self.migrate_from_csv(legacy_csv_path)
+
+    @property
+    def version(self):
+        """ Changes whenever the metadata is modified """
+        return os.stat(self.db_path).st_mtime_ns
+
+    def migrate_from_csv(self, csv_path):
+        """
+        Import the rows of a train_metadata.csv file.
+        """
+        with open(csv_path, newline="") as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        self.add_rows(rows)
+
+    def add_row(self, row):
+        self.add_rows([row])
+
+    def add_rows(self, rows):
+        """
+        Insert several rows in one transaction.
+
+        Parameters:
+        - rows (list): Dicts with the keys file_name, fold, classID and class.
+        """
+        if not rows:
+            return
+
+        with self._lock, metrics.stage("metadata.add_rows"):
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO recordings (file_name, fold, class_id, class) VALUES (?, ?, ?, ?)",
+                    [(row["file_name"], row["fold"], int(row["classID"]), row["class"]) for row in rows])
+
+            for row in rows:
+                self._index_row(row["file_name"], int(row["classID"]), row["class"])
+            self._version = self.version
+
+    def get_class_id(self, class_name):
+        """ Class id of an enrolled class, or the id a new class would get """
+        with self._lock:
+            self._refresh_if_changed()
+            if class_name in self._class_ids:
+                return self._class_ids[class_name]
+            return len(self._classes)
+
+    def next_audio_id(self, class_name):
+        """ Audio id for the next recording of a class """
+        with self._lock:
+            self._refresh_if_changed()
+            return self._last_audio_ids.get(class_name, -1) + 1
+
+    def classes(self):
+        """ Enrolled class names, indexed by class id """
+        with self._lock:
+            self._refresh_if_changed()
+            return list(self._classes)
+
+    def has_classes(self):
+        with self._lock:
+            self._refresh_if_changed()
+            return len(self._classes) > 0
+
+    def rows(self):
+        """ All rows in insertion order, as (file_name, fold, classID, class) tuples """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT file_name, fold, class_id, class FROM recordings ORDER BY id").fetchall()
+
+    def to_dataframe(self):
+        # pandas is only needed for training, so it is not imported at GUI startup
+        import pandas as pd
+
+        return pd.DataFrame(self.rows(), columns=METADATA_COLUMNS)
+
+    def clear(self):
+        with self._lock:
+            with self._connection:
+                self._connection.execute("DELETE FROM recordings")
+            self._refresh_index()
+
+    def _refresh_if_changed(self):
+        if self.version != self._version:
+            self._refresh_index()
+
+    def _refresh_index(self):
+        with self._lock, metrics.stage("metadata.refresh"):
+            self._version = self.version
+            self._classes = []
+            self._class_ids = {}
+            self._last_audio_ids = {}
+            for file_name, _, class_id, class_name in self.rows():
+                self._index_row(file_name, class_id, class_name)
+
+    def _index_row(self, file_name, class_id, class_name):
+        if class_name not in self._class_ids:
+            self._class_ids[class_name] = class_id
+            # class ids are assigned consecutively, so the list is indexed by class id
+            if class_id >= len(self._classes):
+                self._classes.extend([None] * (class_id + 1 - len(self._classes)))
+            self._classes[class_id] = class_name
+
+        audio_id = parse_audio_id(file_name)
+        if audio_id > self._last_audio_ids.get(class_name, -1):
+            self._last_audio_ids[class_name] = audio_id
+
+
+_metadata_store = None
+_metadata_store_lock = threading.Lock()
+
+
+def get_metadata_store():
+    """ Return the process-wide metadata store, creating it (and migrating the CSV) on first use """
+    global _metadata_store
+    with _metadata_store_lock:
+        if _metadata_store is None:
+            _metadata_store = MetadataStore(get_file_path(TRAIN_METADATA_DIR, METADATA_DB_FILENAME),
+                                            get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME))
+        return _metadata_store
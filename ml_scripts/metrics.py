@@ -0,0 +1,152 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Set to 1 to record the stage timings from the start
+METRICS_ENV_VAR = "VOICE_CLASSIFIER_METRICS"
+# Set to a file path to write the metrics when the process exits, as Prometheus text if the
+# path ends with .prom and as JSON otherwise
+METRICS_FILE_ENV_VAR = "VOICE_CLASSIFIER_METRICS_FILE"
+
+# Upper bounds in seconds of the Prometheus histogram buckets
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                    60.0)
+
+PROMETHEUS_METRIC_NAME = "voice_classifier_stage_duration_seconds"
+
+_enabled = os.environ.get(METRICS_ENV_VAR, "").lower() in ("1", "true", "yes")
+_lock = threading.Lock()
+_stages = {}
+_disabled_stage = contextlib.nullcontext()
+
+
+class _StageStats:
+    __slots__ = ("count", "total", "max", "bucket_counts")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+
+
+class _StageTimer:
+    __slots__ = ("name", "start_time")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start_time)
+        return False
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def stage(name):
+    """
+    Context manager timing one pipeline stage, e.g. "predict.forward".
+
+    When metrics are disabled it returns a shared no-op context, so an instrumented stage costs a
+    single function call. Timings are wall clock: CUDA kernels run asynchronously, so on a GPU a
+    stage may only include the time to launch them. Every process records its own metrics, e.g.
+    stages run in DataLoader worker processes are not part of the training process' metrics.
+    """
+    if not _enabled:
+        return _disabled_stage
+    return _StageTimer(name)
+
+
+def record(name, seconds):
+    """ Record one run of a stage that took the given number of seconds """
+    with _lock:
+        stats = _stages.get(name)
+        if stats is None:
+            stats = _stages[name] = _StageStats()
+        stats.count += 1
+        stats.total += seconds
+        stats.max = max(stats.max, seconds)
+        for i, upper_bound in enumerate(DURATION_BUCKETS):
+            if seconds <= upper_bound:
+                stats.bucket_counts[i] += 1
+                break
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def snapshot():
+    """
+    Return the recorded metrics.
+
+    Returns:
+    dict: Stage name -> count, total_s, mean_ms and max_ms.
+    """
+    with _lock:
+        return {
+            name: {
+                "count": stats.count,
+                "total_s": stats.total,
+                "mean_ms": stats.total / stats.count * 1000,
+                "max_ms": stats.max * 1000
+            }
+            for name, stats in sorted(_stages.items())
+        }
+
+
+def to_prometheus():
+    """ Return the recorded metrics as a histogram in the Prometheus text exposition format """
+    lines = [
+        f"# HELP {PROMETHEUS_METRIC_NAME} Duration of the stages of the audio pipeline.",
+        f"# TYPE {PROMETHEUS_METRIC_NAME} histogram"
+    ]
+    with _lock:
+        for name, stats in sorted(_stages.items()):
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(DURATION_BUCKETS, stats.bucket_counts):
+                cumulative_count += bucket_count
+                lines.append(f'{PROMETHEUS_METRIC_NAME}_bucket{{stage="{name}",le="{upper_bound}"}} {cumulative_count}')
+            lines.append(f'{PROMETHEUS_METRIC_NAME}_bucket{{stage="{name}",le="+Inf"}} {stats.count}')
+            lines.append(f'{PROMETHEUS_METRIC_NAME}_sum{{stage="{name}"}} {stats.total}')
+            lines.append(f'{PROMETHEUS_METRIC_NAME}_count{{stage="{name}"}} {stats.count}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    """ Write the recorded metrics, as Prometheus text if path ends with .prom and as JSON otherwise """
+    with open(path, "w") as metrics_file:
+        if path.endswith(".prom"):
+            metrics_file.write(to_prometheus())
+        else:
+            json.dump(snapshot(), metrics_file, indent=2)
+
+
+def _write_metrics_at_exit(path, pid):
+    # forked worker processes inherit the handler, only the process that registered it writes
+    if os.getpid() == pid:
+        write_metrics(path)
+
+
+if os.environ.get(METRICS_FILE_ENV_VAR):
+    atexit.register(_write_metrics_at_exit, os.path.abspath(os.environ[METRICS_FILE_ENV_VAR]), os.getpid())
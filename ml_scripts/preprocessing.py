@@ -0,0 +1,136 @@
+import math
+import threading
+
+import torch
+import torchaudio
+from ml_scripts.utils import *
+
+# (orig_sr, target_sr, device) -> Resample module. Building a Resample computes its kernel,
+# so every pair of sample rates is only built once per process.
+_resamplers = {}
+_resamplers_lock = threading.Lock()
+
+
+def get_resampler(orig_sr, target_sr, device="cpu"):
+    key = (int(orig_sr), int(target_sr), str(device))
+    resampler = _resamplers.get(key)
+    if resampler is None:
+        with _resamplers_lock:
+            resampler = _resamplers.get(key)
+            if resampler is None:
+                resampler = torchaudio.transforms.Resample(orig_sr, target_sr).to(device)
+                _resamplers[key] = resampler
+    return resampler
+
+
+def resample_if_necessary(signal, sr, target_sample_rate=SAMPLE_RATE):
+    if sr != target_sample_rate:
+        signal = get_resampler(sr, target_sample_rate, signal.device)(signal)
+    return signal
+
+
+def mix_down_if_necessary(signal):
+    if signal.shape[0] > 1:
+        signal = torch.mean(signal, dim=0, keepdim=True)
+    return signal
+
+
+def cut_if_necessary(signal, num_samples):
+    if signal.shape[-1] > num_samples:
+        signal = signal[..., :num_samples]
+    return signal
+
+
+def cut_to_most_voiced_window(signal, num_samples):
+    """
+    Cut a mono (1, samples) waveform to its num_samples long window with the most energy, so a
+    recording with leading noise or a late start is classified by the part with the voice.
+    """
+    if signal.shape[-1] <= num_samples:
+        return signal
+    # float64, so the running sum over a long recording does not lose precision
+    cumulative_energy = torch.nn.functional.pad(signal[0].double().square().cumsum(0), (1, 0))
+    start = int(torch.argmax(cumulative_energy[num_samples:] - cumulative_energy[:-num_samples]))
+    return signal[..., start:start + num_samples]
+
+
+def right_pad_if_necessary(signal, num_samples):
+    length_signal = signal.shape[-1]
+    if length_signal < num_samples:
+        num_missing_samples = num_samples - length_signal
+        last_dim_padding = (0, num_missing_samples)
+        signal = torch.nn.functional.pad(signal, last_dim_padding)
+    return signal
+
+
+def prepare_signal(signal, sr, target_sample_rate=SAMPLE_RATE, num_samples=NUM_SAMPLES):
+    """
+    Bring a (channels, samples) waveform to mono, target_sample_rate and exactly num_samples.
+    Longer waveforms are cut to their most voiced window.
+    """
+    signal = resample_if_necessary(signal, sr, target_sample_rate)
+    signal = mix_down_if_necessary(signal)
+    signal = cut_to_most_voiced_window(signal, num_samples)
+    signal = right_pad_if_necessary(signal, num_samples)
+    return signal
+
+
+def split_into_windows(signal, num_samples=NUM_SAMPLES, hop_samples=NUM_SAMPLES // 2):
+    """
+    Split a mono (1, samples) waveform into overlapping windows of num_samples, hop_samples apart.
+    The last window ends with the signal, so the tail is covered without padding it with silence.
+    Signals shorter than one window are padded to a single window.
+
+    Returns:
+    torch.Tensor: Windows of shape (windows, 1, num_samples).
+    """
+    signal = right_pad_if_necessary(signal, num_samples)
+    # a view of the signal, the windows are not copied
+    windows = signal[0].unfold(0, num_samples, hop_samples)
+    if (signal.shape[-1] - num_samples) % hop_samples:
+        windows = torch.cat((windows, signal[:, -num_samples:]))
+    return windows.unsqueeze(1)
+
+
+def extract_features_batch(signals, transformation, target_sample_rate=SAMPLE_RATE,
+                           num_samples=NUM_SAMPLES, device="cpu"):
+    """
+    Turn variable-length waveforms into a batch of features.
+
+    Signals are grouped by sample rate. Every signal is cut to its most voiced window of the
+    length needed for one model window, and every group is stacked, resampled and transformed
+    with one vectorized call.
+
+    Parameters:
+    - signals (list): (signal, sr) pairs, where signal is a (channels, samples) tensor.
+    - transformation (torch.nn.Module): Feature transform, e.g. the mel spectrogram.
+    - target_sample_rate (int): Sample rate expected by the model.
+    - num_samples (int): Number of samples per model window at target_sample_rate.
+    - device (str): Device the preprocessing runs on.
+
+    Returns:
+    torch.Tensor: Features of shape (len(signals), 1, ...), in the order of the input.
+    """
+    groups = {}
+    for index, (_, sr) in enumerate(signals):
+        groups.setdefault(int(sr), []).append(index)
+
+    features = [None] * len(signals)
+    for sr, indices in groups.items():
+        # only the samples that end up in the model window are resampled
+        source_length = int(math.ceil(num_samples * sr / target_sample_rate))
+        group = torch.stack([
+            right_pad_if_necessary(cut_to_most_voiced_window(mix_down_if_necessary(signals[i][0]), source_length),
+                                   source_length)
+            for i in indices
+        ]).to(device)
+
+        group = resample_if_necessary(group, sr, target_sample_rate)
+        group = cut_if_necessary(group, num_samples)
+        group = right_pad_if_necessary(group, num_samples)
+        group_features = transformation(group)
+
+        for i, feature in zip(indices, group_features):
+            features[i] = feature
+
+    return torch.stack(features)
@@ -0,0 +1,112 @@
+import threading
+import time
+
+# Enrollments arriving within this many seconds of each other are trained in one job
+TRAINING_DEBOUNCE_SECONDS = 2.0
+
+
+class TrainingScheduler:
+    """
+    Runs training jobs one at a time on a single background thread.
+
+    Enrollments are queued with submit. Pending enrollments are coalesced into one job once no
+    new enrollment has arrived for debounce_seconds. A running job is superseded by a new
+    enrollment: it is cancelled, and its recordings are trained together with the new ones in
+    the next job. Since only one job runs at a time, finished models never race each other.
+    """
+
+    def __init__(self, run_job, debounce_seconds=TRAINING_DEBOUNCE_SECONDS):
+        """
+        Parameters:
+        - run_job (callable): Called as run_job(file_names, cancel_event) on the scheduler thread.
+          Must stop soon after cancel_event is set and return True if it published a model.
+        - debounce_seconds (float): Quiet period before pending enrollments are trained.
+        """
+        self.run_job = run_job
+        self.debounce_seconds = debounce_seconds
+
+        self._condition = threading.Condition()
+        self._pending_file_names = []
+        self._ready = False
+        self._last_submit_time = 0.0
+        self._running_file_names = None
+        self._cancel_event = None
+        self._worker = None
+        # incremented by reset, so a job that was started before it does not requeue its recordings
+        self._generation = 0
+
+    def submit(self, new_file_names):
+        """
+        Queue newly enrolled recordings for training.
+
+        Parameters:
+        - new_file_names (list): File names of the new recordings.
+        """
+        with self._condition:
+            self._pending_file_names.extend(new_file_names)
+            self._ready = True
+            self._last_submit_time = time.monotonic()
+
+            if self._cancel_event is not None:
+                # the running job is stale now, its recordings are trained again in the next job
+                self._cancel_event.set()
+
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._condition.notify()
+
+    def cancel(self):
+        """
+        Cancel the running job. Its recordings stay pending and are trained with the next enrollment.
+        """
+        with self._condition:
+            self._ready = False
+            if self._cancel_event is not None:
+                self._cancel_event.set()
+            self._condition.notify()
+
+    def reset(self):
+        """
+        Cancel the running job and drop every pending recording, e.g. because the training data
+        was deleted. The cancelled job does not publish a model.
+        """
+        with self._condition:
+            self._pending_file_names = []
+            self._ready = False
+            self._generation += 1
+            if self._cancel_event is not None:
+                self._cancel_event.set()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._ready:
+                        remaining = self._last_submit_time + self.debounce_seconds - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+
+                file_names = list(dict.fromkeys(self._pending_file_names))
+                self._pending_file_names = []
+                self._ready = False
+                self._running_file_names = file_names
+                self._cancel_event = cancel_event = threading.Event()
+                generation = self._generation
+
+            try:
+                published = self.run_job(file_names, cancel_event)
+            except Exception as e:
+                print(f"Training job failed: {e}")
+                published = False
+
+            with self._condition:
+                if not published and generation == self._generation:
+                    # keep the recordings for the next job
+                    self._pending_file_names = file_names + self._pending_file_names
+                self._running_file_names = None
+                self._cancel_event = None
@@ -0,0 +1,348 @@
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import torchaudio
+from ml_scripts import metrics
+from ml_scripts.inference import get_inference_engine, pcm_to_signal
+from ml_scripts.utils import *
+
+# Only processes on this machine can reach the service
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+
+# A batch is run as soon as it holds SERVER_MAX_BATCH_SIZE requests, or SERVER_MAX_WAIT_MS after
+# its first request arrived
+SERVER_MAX_BATCH_SIZE = 32
+SERVER_MAX_WAIT_MS = 10
+
+MAX_REQUEST_BYTES = 10 * 2 ** 20
+# Accepted sample rates of the request audio
+MIN_REQUEST_SAMPLE_RATE = 1000
+MAX_REQUEST_SAMPLE_RATE = 384000
+REQUEST_TIMEOUT_SECONDS = 30
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class DynamicBatcher:
+    """
+    Collects prediction requests from many threads in a queue and runs them through the model
+    together. A batch is flushed when it is full or when its oldest request has waited
+    max_wait_ms, so a single request is never delayed by more than max_wait_ms.
+    """
+
+    def __init__(self, engine, max_batch_size=SERVER_MAX_BATCH_SIZE, max_wait_ms=SERVER_MAX_WAIT_MS):
+        """
+        Parameters:
+        - engine (InferenceEngine): Engine the batches are run on.
+        - max_batch_size (int): Maximum number of requests per forward pass.
+        - max_wait_ms (float): Maximum time a request waits for other requests to join its batch.
+        """
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.requests_total = 0
+        self.batches_total = 0
+        self.batch_size_sum = 0
+        self.batch_size_counts = [0] * len(BATCH_SIZE_BUCKETS)
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self):
+        """ Number of requests waiting for a batch """
+        return self._queue.qsize()
+
+    def submit(self, signal, sr):
+        """
+        Queue a (channels, samples) waveform for prediction.
+
+        Returns:
+        concurrent.futures.Future: Resolves to the predicted class, the probabilities of all known
+        classes, the class names in the order of the probabilities and the size of the batch the
+        request was run in.
+        """
+        future = Future()
+        self._queue.put((signal, sr, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect_batch(self):
+        first_request = self._queue.get()
+        if first_request is None:
+            return None
+
+        batch = [first_request]
+        deadline = first_request[3] + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            batch_start_time = time.perf_counter()
+            for _, _, _, enqueue_time in batch:
+                metrics.record("server.queue_wait", batch_start_time - enqueue_time)
+
+            with metrics.stage("server.batch"):
+                # every request is preprocessed on its own, so a bad one only fails its own future
+                features, futures = [], []
+                for signal, sr, future, _ in batch:
+                    try:
+                        features.append(self.engine.extract_signal_features(signal, sr))
+                        futures.append(future)
+                    except Exception as e:
+                        future.set_exception(e)
+
+                try:
+                    probabilities, class_mapping = \
+                        self.engine.classify_feature_groups(features) if features else ([], None)
+                    for future, request_probabilities in zip(futures, probabilities):
+                        future.set_result((class_mapping[request_probabilities.argmax(0)], request_probabilities,
+                                           class_mapping, len(batch)))
+                except Exception as e:
+                    for future in futures:
+                        future.set_exception(e)
+
+            self._record_batch(len(batch))
+
+    def _record_batch(self, batch_size):
+        with self._stats_lock:
+            self.requests_total += batch_size
+            self.batches_total += 1
+            self.batch_size_sum += batch_size
+            for i, upper_bound in enumerate(BATCH_SIZE_BUCKETS):
+                if batch_size <= upper_bound:
+                    self.batch_size_counts[i] += 1
+                    break
+
+    def stats(self):
+        """ Queue depth, request and batch counters and the mean batch size, as a dict """
+        with self._stats_lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "requests_total": self.requests_total,
+                "batches_total": self.batches_total,
+                "mean_batch_size": self.batch_size_sum / self.batches_total if self.batches_total else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "stages": metrics.snapshot()
+            }
+
+    def to_prometheus(self):
+        """ Queue depth, counters and the batch size histogram in the Prometheus text format """
+        with self._stats_lock:
+            lines = [
+                "# HELP voice_classifier_queue_depth Prediction requests waiting for a batch.",
+                "# TYPE voice_classifier_queue_depth gauge",
+                f"voice_classifier_queue_depth {self.queue_depth}",
+                "# HELP voice_classifier_requests_total Prediction requests run through the model.",
+                "# TYPE voice_classifier_requests_total counter",
+                f"voice_classifier_requests_total {self.requests_total}",
+                "# HELP voice_classifier_batch_size Requests per forward pass.",
+                "# TYPE voice_classifier_batch_size histogram"
+            ]
+            cumulative_count = 0
+            for upper_bound, count in zip(BATCH_SIZE_BUCKETS, self.batch_size_counts):
+                cumulative_count += count
+                lines.append(f'voice_classifier_batch_size_bucket{{le="{upper_bound}"}} {cumulative_count}')
+            lines.append(f'voice_classifier_batch_size_bucket{{le="+Inf"}} {self.batches_total}')
+            lines.append(f"voice_classifier_batch_size_sum {self.batch_size_sum}")
+            lines.append(f"voice_classifier_batch_size_count {self.batches_total}")
+
+        # request latency, queue wait and the stages of the pipeline
+        return "\n".join(lines) + "\n" + metrics.to_prometheus()
+
+
+def decode_audio(body, sample_rate=None):
+    """
+    Decode a request body: an audio file (WAV, FLAC, ...), or raw mono 16-bit PCM if sample_rate is given.
+
+    Returns:
+    tuple: (channels, samples) waveform and its sample rate.
+
+    Raises:
+    ValueError: If the audio is empty, not 16-bit PCM or has an unsupported sample rate.
+    """
+    if sample_rate is not None:
+        if len(body) % 2:
+            raise ValueError("Raw PCM audio must be 16-bit")
+        signal = pcm_to_signal(body)
+    else:
+        signal, sample_rate = torchaudio.load(io.BytesIO(body))
+
+    if signal.numel() == 0:
+        raise ValueError("The audio has no samples")
+    if not MIN_REQUEST_SAMPLE_RATE <= sample_rate <= MAX_REQUEST_SAMPLE_RATE:
+        raise ValueError(f"The sample rate must be between {MIN_REQUEST_SAMPLE_RATE} "
+                         f"and {MAX_REQUEST_SAMPLE_RATE} Hz, not {sample_rate}")
+    return signal, sample_rate
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict   Classify the audio in the request body. Add ?sample_rate=N for raw 16-bit PCM.
+    GET /metrics    Metrics in the Prometheus text format.
+    GET /stats      Metrics as JSON.
+    GET /health     Liveness check.
+    """
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/metrics":
+            self._send(200, self.server.batcher.to_prometheus().encode(), "text/plain; version=0.0.4")
+        elif path == "/stats":
+            self._send_json(200, self.server.batcher.stats())
+        else:
+            self._send_json(404, {"error": f"Unknown path {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self._send_json(404, {"error": f"Unknown path {url.path}"})
+            return
+
+        start_time = time.perf_counter()
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            self._send_json(400, {"error": "The request has no audio"})
+            return
+        if length > MAX_REQUEST_BYTES:
+            self._send_json(413, {"error": f"The audio is larger than {MAX_REQUEST_BYTES} bytes"})
+            return
+        body = self.rfile.read(length)
+
+        batcher = self.server.batcher
+        if not os.path.isfile(batcher.engine.model_path):
+            self._send_json(503, {"error": "The model needs to be trained"})
+            return
+
+        try:
+            sample_rate = parse_qs(url.query).get("sample_rate")
+            with metrics.stage("server.decode"):
+                signal, sr = decode_audio(body, int(sample_rate[0]) if sample_rate else None)
+        except Exception as e:
+            self._send_json(400, {"error": f"Could not decode the audio: {e}"})
+            return
+
+        try:
+            predicted, probabilities, class_mapping, batch_size = \
+                batcher.submit(signal, sr).result(REQUEST_TIMEOUT_SECONDS)
+        except Exception as e:
+            self._send_json(500, {"error": f"Prediction failed: {e}"})
+            return
+
+        latency = time.perf_counter() - start_time
+        metrics.record("server.request", latency)
+        self._send_json(200, {
+            "class": predicted,
+            "probabilities": {class_name: probability.item()
+                              for class_name, probability in zip(class_mapping, probabilities)},
+            "batch_size": batch_size,
+            "latency_ms": latency * 1000
+        })
+
+    def log_message(self, format, *args):
+        # one log line per request would slow down the service, the metrics cover the traffic
+        pass
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode(), "application/json")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(host=SERVER_HOST, port=SERVER_PORT, max_batch_size=SERVER_MAX_BATCH_SIZE,
+                  max_wait_ms=SERVER_MAX_WAIT_MS):
+    """
+    Create the HTTP inference service. Every request is handled on its own thread, and the
+    requests meet in one DynamicBatcher. Call serve_forever() on the result to run it.
+    """
+    # the service exposes its latency and batch metrics
+    metrics.enable()
+    server = ThreadingHTTPServer((host, port), InferenceRequestHandler)
+    server.daemon_threads = True
+    server.batcher = DynamicBatcher(get_inference_engine(), max_batch_size, max_wait_ms)
+    return server
+
+
+def request_prediction(audio_file, host=SERVER_HOST, port=SERVER_PORT):
+    """
+    Client for the service: classify an audio file.
+
+    Returns:
+    dict: Response of POST /predict.
+    """
+    with open(audio_file, "rb") as f:
+        body = f.read()
+    request = urllib.request.Request(f"http://{host}:{port}/predict", data=body,
+                                     headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_SECONDS) as response:
+        return json.load(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve speaker predictions over HTTP on this machine.")
+    parser.add_argument("--host", default=SERVER_HOST,
+                        help="Address to bind to. Keep the default to accept local clients only")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=SERVER_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=SERVER_MAX_WAIT_MS)
+    parser.add_argument("--predict", metavar="AUDIO_FILE",
+                        help="Act as a client: send an audio file to a running service and print the result")
+    args = parser.parse_args()
+
+    if args.predict:
+        print(json.dumps(request_prediction(args.predict, args.host, args.port), indent=2))
+        return
+
+    server = create_server(args.host, args.port, args.max_batch_size, args.max_wait_ms)
+    print(f"Serving predictions on http://{args.host}:{args.port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import json
+
+import numpy as np
+import pandas as pd
+import torch
+import torchaudio
+from torch.utils.data import Dataset
+from ml_scripts.preprocessing import prepare_signal, mix_down_if_necessary, cut_if_necessary, \
+    right_pad_if_necessary
+from ml_scripts.utils import *
+
+WAVEFORMS_FILENAME = "waveforms.npy"
+LABELS_FILENAME = "labels.npy"
+INDEX_FILENAME = "index.json"
+
+
+def _read_index(shard_dir):
+    index_path = os.path.join(shard_dir, INDEX_FILENAME)
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+
+def pack_dataset(rows, shard_dir, target_sample_rate=SAMPLE_RATE, num_samples=NUM_SAMPLES):
+    """
+    Pack the training clips into one contiguous (clips, num_samples) float32 array on disk.
+
+    Every clip is decoded and canonicalized to mono, target_sample_rate and num_samples once.
+    Clips that are already in an up-to-date shard are copied from it instead of being decoded
+    again, so packing after an enrollment only decodes the new recordings.
+
+    Parameters:
+    - rows (list): (file_name, fold, classID, class) metadata rows.
+    - shard_dir (str): Directory of the shard.
+    - target_sample_rate (int): Sample rate of the packed clips.
+    - num_samples (int): Length of the packed clips.
+
+    Returns:
+    bool: True if the shard was (re)written, False if it was already up to date.
+    """
+    file_names = [row[0] for row in rows]
+    # "window": clips are cut to their most voiced window, not to their first samples
+    params = {"sample_rate": target_sample_rate, "num_samples": num_samples, "window": "voiced"}
+
+    old_index = _read_index(shard_dir)
+    if old_index is not None and old_index["params"] == params and old_index["file_names"] == file_names:
+        return False
+
+    os.makedirs(shard_dir, exist_ok=True)
+    old_waveforms = None
+    old_rows = {}
+    if old_index is not None and old_index["params"] == params:
+        old_waveforms = np.load(os.path.join(shard_dir, WAVEFORMS_FILENAME), mmap_mode="r")
+        old_rows = {file_name: i for i, file_name in enumerate(old_index["file_names"])}
+
+    tmp_waveforms_path = os.path.join(shard_dir, f"{WAVEFORMS_FILENAME}.tmp")
+    waveforms = np.lib.format.open_memmap(tmp_waveforms_path, mode="w+", dtype=np.float32,
+                                          shape=(len(rows), num_samples))
+    labels = np.empty(len(rows), dtype=np.int64)
+
+    for i, (file_name, fold, class_id, _) in enumerate(rows):
+        if file_name in old_rows:
+            waveforms[i] = old_waveforms[old_rows[file_name]]
+        else:
+            signal, sr = torchaudio.load(fold)
+            waveforms[i] = prepare_signal(signal, sr, target_sample_rate, num_samples)[0].numpy()
+        labels[i] = class_id
+
+    waveforms.flush()
+    del waveforms, old_waveforms
+
+    # the index is removed first, so an interrupted packing can never pair it with other clips
+    index_path = os.path.join(shard_dir, INDEX_FILENAME)
+    if os.path.isfile(index_path):
+        os.remove(index_path)
+
+    np.save(os.path.join(shard_dir, LABELS_FILENAME), labels)
+    os.replace(tmp_waveforms_path, os.path.join(shard_dir, WAVEFORMS_FILENAME))
+
+    index = {
+        "params": params,
+        "file_names": file_names,
+        # clip i starts at sample offset i * num_samples of the flattened array
+        "offsets": [i * num_samples for i in range(len(rows))]
+    }
+    with open(index_path, "w") as index_file:
+        json.dump(index, index_file)
+
+    return True
+
+
+class ShardDataset(Dataset):
+    """
+    Dataset over a packed waveform shard. Clips are sliced out of the memory-mapped array
+    without copying, so epochs are served by the OS page cache instead of per-file decoding.
+    """
+
+    def __init__(self, shard_dir, transformation, augmentation=None):
+        index = _read_index(shard_dir)
+        self.shard_dir = shard_dir
+        self.transformation = transformation
+        self.augmentation = augmentation
+        self.target_sample_rate = index["params"]["sample_rate"]
+        self.num_samples = index["params"]["num_samples"]
+
+        labels = np.load(os.path.join(shard_dir, LABELS_FILENAME))
+        self.annotations = pd.DataFrame({"file_name": index["file_names"], "classID": labels})
+        self.labels = labels
+
+        # opened lazily, so the dataset can be pickled to DataLoader workers cheaply
+        self._waveforms = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if self._waveforms is None:
+            # copy-on-write mapping: a writable view for torch, the file itself is never modified
+            self._waveforms = np.load(os.path.join(self.shard_dir, WAVEFORMS_FILENAME), mmap_mode="c")
+
+        signal = torch.from_numpy(self._waveforms[index]).unsqueeze(0)
+        if self.augmentation is not None:
+            signal = self.augmentation(signal, self.target_sample_rate)
+            signal = right_pad_if_necessary(cut_if_necessary(mix_down_if_necessary(signal), self.num_samples),
+                                            self.num_samples)
+
+        if self.transformation is not None:
+            signal = self.transformation(signal)
+        return signal, int(self.labels[index])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_waveforms"] = None
+        return state
@@ -0,0 +1,126 @@
+import math
+import threading
+
+import numpy as np
+import torch
+from ml_scripts.inference import pcm_to_signal
+from ml_scripts.utils import *
+
+# Run the model every quarter of a second of new audio
+STREAM_HOP_SAMPLES = SAMPLE_RATE // 4
+# Weight of the previous rolling probabilities when a new window is scored
+STREAM_SMOOTHING = 0.6
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer that keeps the most recent samples of a stream.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.write_index = 0
+        self.size = 0
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        end = self.write_index + len(samples)
+        if end <= self.capacity:
+            self.buffer[self.write_index:end] = samples
+        else:
+            split = self.capacity - self.write_index
+            self.buffer[self.write_index:] = samples[:split]
+            self.buffer[:end - self.capacity] = samples[split:]
+        self.write_index = end % self.capacity
+        self.size = min(self.capacity, self.size + len(samples))
+
+    def latest(self):
+        """ Return the buffered samples in chronological order """
+        if self.size < self.capacity:
+            return self.buffer[:self.size].copy()
+        return np.concatenate((self.buffer[self.write_index:], self.buffer[:self.write_index]))
+
+
+class StreamingPredictor:
+    """
+    Rolling speaker prediction over a live audio stream.
+
+    Audio chunks are pushed into a ring buffer that holds one model window (NUM_SAMPLES at
+    SAMPLE_RATE). A worker thread scores the latest window whenever hop_samples new samples
+    have arrived. If the model falls behind, intermediate windows are skipped rather than
+    queued, so both latency and memory stay bounded.
+    """
+
+    def __init__(self, engine, sample_rate, on_prediction, hop_samples=STREAM_HOP_SAMPLES,
+                 smoothing=STREAM_SMOOTHING):
+        """
+        Parameters:
+        - engine (InferenceEngine): Engine used to score the windows.
+        - sample_rate (int): Sample rate of the pushed audio.
+        - on_prediction (callable): Called with the predicted class and the rolling probabilities.
+        - hop_samples (int): Number of new samples, at SAMPLE_RATE, between two predictions.
+        - smoothing (float): Exponential smoothing factor of the rolling probabilities.
+        """
+        self.engine = engine
+        self.sample_rate = sample_rate
+        self.on_prediction = on_prediction
+        self.smoothing = smoothing
+
+        scale = sample_rate / SAMPLE_RATE
+        self.hop_samples = max(1, int(hop_samples * scale))
+        self.ring_buffer = RingBuffer(int(math.ceil(NUM_SAMPLES * scale)))
+
+        self.rolling_probabilities = None
+        self._new_samples = 0
+        self._running = False
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def start(self):
+        self._running = True
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def push(self, pcm_bytes):
+        """
+        Add a chunk of 16-bit mono PCM audio to the stream.
+        """
+        samples = pcm_to_signal(pcm_bytes).numpy()[0]
+        with self._condition:
+            self.ring_buffer.write(samples)
+            self._new_samples += len(samples)
+            if self._new_samples >= self.hop_samples:
+                self._condition.notify()
+
+    def _run(self):
+        # the model is loaded here, not on the caller's thread, which is usually the Tk main thread
+        self.engine.reload_if_changed()
+        while True:
+            with self._condition:
+                while self._running and self._new_samples < self.hop_samples:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                window = self.ring_buffer.latest()
+                self._new_samples = 0
+
+            features = self.engine.extract_features(torch.from_numpy(window).unsqueeze(0), self.sample_rate)
+            probabilities, class_mapping = self.engine.classify_features(features.unsqueeze(0))
+            probabilities = probabilities[0]
+
+            if self.rolling_probabilities is None or len(self.rolling_probabilities) != len(probabilities):
+                self.rolling_probabilities = probabilities
+            else:
+                self.rolling_probabilities = (self.smoothing * self.rolling_probabilities +
+                                              (1 - self.smoothing) * probabilities)
+
+            predicted = class_mapping[self.rolling_probabilities.argmax(0)]
+            self.on_prediction(predicted, self.rolling_probabilities)
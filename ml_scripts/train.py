@@ -1,91 +1,624 @@
+import argparse
+import copy
+import random
+import signal
+import threading
+import time
+from collections import Counter
+
+import numpy as np
 import torch
 import torchaudio
 from torch import nn
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
+from augmentation import OnlineAugmentation, AUGMENTED_COPIES
+from ml_scripts import metrics
 from ml_scripts.AppDataset import AppDataset
-from ml_scripts.cnn import CNNNetwork
+from ml_scripts.batch_augmentation import BatchAugmentation
+from ml_scripts.cnn import CNNNetwork, NUM_CLASSES, num_classes_in_state_dict
+from ml_scripts.feature_cache import FeatureCache
+from ml_scripts.metadata_store import get_metadata_store, parse_audio_id
+from ml_scripts.shards import ShardDataset, pack_dataset
 from ml_scripts.utils import *
 
 BATCH_SIZE = 128
 EPOCHS = 100
 LEARNING_RATE = 0.001
 
-ANNOTATIONS_FILE = get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME)
+# Data loading: samples are decoded and transformed by worker processes on the CPU,
+# overlapping with the forward and backward passes. Only full training uses them, the few
+# batches of a fine-tuning job are loaded in the main process (FINE_TUNE_NUM_WORKERS)
+NUM_WORKERS = min(4, os.cpu_count() or 1)
+PERSISTENT_WORKERS = True
+PREFETCH_FACTOR = 2
+PIN_MEMORY = torch.cuda.is_available()
+FINE_TUNE_NUM_WORKERS = 0
+
+# Share of the clips held out for validation, and the number of epochs without
+# an improvement of the validation loss after which training stops early
+VALIDATION_SPLIT = 0.2
+PATIENCE = 10
+MIN_DELTA = 1e-4
+SPLIT_SEED = 0
+
+CHECKPOINT_EVERY_EPOCHS = 1
+
+# Warm-start fine-tuning after a new recording is enrolled
+FINE_TUNE_STEPS = 30
+FINE_TUNE_LEARNING_RATE = 0.0005
+# Number of already known clips replayed per new clip, so old speakers are not forgotten
+REPLAY_RATIO = 4
+
 AUDIO_DIR = resource_path(TRAIN_DIR)
 
 
-def create_data_loader(train_data, batch_size):
-    train_dataloader = DataLoader(train_data, batch_size=batch_size)
+def create_dataset(augmentation_mode=AUGMENTATION_MODE):
+    # in batch augmentation mode the dataset yields waveforms, and the mel spectrogram
+    # is computed on the training device after the batch has been augmented
+    returns_waveforms = augmentation_mode == AUGMENTATION_MODE_BATCH
+
+    feature_cache = FeatureCache(os.path.join(resource_path(FEATURE_CACHE_DIR),
+                                              "waveform" if returns_waveforms else "mel"),
+                                 sample_rate=SAMPLE_RATE,
+                                 num_samples=NUM_SAMPLES,
+                                 window="voiced",
+                                 n_fft=N_FFT,
+                                 hop_length=HOP_LENGTH,
+                                 n_mels=N_MELS)
+
+    if augmentation_mode == AUGMENTATION_MODE_ONLINE:
+        augmentation = OnlineAugmentation()
+    else:
+        augmentation = None
+
+    if USE_WAVEFORM_SHARDS:
+        # only clips that are not packed yet are decoded
+        shard_dir = resource_path(SHARD_DIR)
+        pack_dataset(get_metadata_store().rows(), shard_dir, SAMPLE_RATE, NUM_SAMPLES)
+        return ShardDataset(shard_dir,
+                            None if returns_waveforms else get_mel_spectrogram(),
+                            augmentation)
+
+    return AppDataset(get_metadata_store().to_dataframe(),
+                      AUDIO_DIR,
+                      None if returns_waveforms else get_mel_spectrogram(),
+                      SAMPLE_RATE,
+                      NUM_SAMPLES,
+                      feature_cache,
+                      augmentation)
+
+
+def create_batch_transform(device, augmentation_mode=AUGMENTATION_MODE):
+    """
+    Return the module applied to every batch inside the training loop, or None.
+    In batch augmentation mode it augments the waveforms and computes their mel spectrograms.
+    """
+    if augmentation_mode != AUGMENTATION_MODE_BATCH:
+        return None
+    # a copy, so moving it to the training device does not move the shared transform
+    return nn.Sequential(BatchAugmentation(SAMPLE_RATE), copy.deepcopy(get_mel_spectrogram())).to(device)
+
+
+def create_data_loader(train_data, batch_size, shuffle=False, num_workers=NUM_WORKERS,
+                       persistent_workers=PERSISTENT_WORKERS, prefetch_factor=PREFETCH_FACTOR,
+                       pin_memory=PIN_MEMORY):
+    worker_options = {}
+    if num_workers > 0:
+        # only valid with worker processes
+        worker_options = {"persistent_workers": persistent_workers, "prefetch_factor": prefetch_factor}
+
+    train_dataloader = DataLoader(train_data,
+                                  batch_size=batch_size,
+                                  shuffle=shuffle,
+                                  num_workers=num_workers,
+                                  pin_memory=pin_memory,
+                                  **worker_options)
     return train_dataloader
 
 
-def train_single_epoch(model, data_loader, loss_fn, optimiser, device):
-    for input, target in data_loader:
-        input, target = input.to(device), target.to(device)
+def get_device():
+    if torch.cuda.is_available():
+        device = "cuda"
+    else:
+        device = "cpu"
+
+    print(f"Using {device}")
+    return device
+
+
+def recording_groups(annotations, augmentation_mode=AUGMENTATION_MODE):
+    """
+    Group key of every clip, shared by a recording and its augmented copies.
+
+    In materialized augmentation mode the copies of a recording with audio id N have the ids
+    N + 1 .. N + AUGMENTED_COPIES, so the audio ids of a class come in blocks of AUGMENTED_COPIES + 1.
+
+    Returns:
+    list: (classID, audio id block) of every row of annotations.
+    """
+    block_size = AUGMENTED_COPIES + 1 if augmentation_mode == AUGMENTATION_MODE_MATERIALIZED else 1
+    return [(int(class_id), parse_audio_id(file_name) // block_size)
+            for file_name, class_id in zip(annotations['file_name'], annotations['classID'])]
+
+
+def split_indices(groups, validation_split, seed=SPLIT_SEED):
+    """
+    Randomly split the sample indices into training and validation indices. All samples of a group
+    (a recording and its augmented copies) end up on the same side, so the validation clips are
+    never augmented copies of training clips. The split is reproducible for a given seed.
+
+    Parameters:
+    - groups (list): Group key of every sample, see recording_groups.
+    - validation_split (float): Maximum share of the samples held out for validation.
+    """
+    unique_groups = list(dict.fromkeys(groups))
+    group_sizes = Counter(groups)
+    num_validation = int(len(groups) * validation_split)
+
+    generator = torch.Generator().manual_seed(seed)
+    validation_groups = set()
+    validation_size = 0
+    for i in torch.randperm(len(unique_groups), generator=generator).tolist():
+        # whole groups only, so the validation set may be smaller than num_validation or even empty
+        if validation_size + group_sizes[unique_groups[i]] <= num_validation:
+            validation_groups.add(unique_groups[i])
+            validation_size += group_sizes[unique_groups[i]]
+
+    train_indices = [i for i, group in enumerate(groups) if group not in validation_groups]
+    validation_indices = [i for i, group in enumerate(groups) if group in validation_groups]
+    return train_indices, validation_indices
+
+
+def train_single_epoch(model, data_loader, loss_fn, optimiser, device, batch_transform=None, cancel_event=None):
+    model.train()
+    if batch_transform is not None:
+        batch_transform.train()
+
+    total_loss = 0.0
+    num_batches = 0
+    epoch_start_time = time.perf_counter()
+    batches = iter(data_loader)
+    while True:
+        # time spent waiting for the data loader, i.e. decoding and feature extraction not hidden by workers
+        with metrics.stage("train.data_wait"):
+            batch = next(batches, None)
+        if batch is None or (cancel_event is not None and cancel_event.is_set()):
+            break
+        input, target = batch
+
+        with metrics.stage("train.transfer"):
+            input, target = input.to(device, non_blocking=True), target.to(device, non_blocking=True)
+        if batch_transform is not None:
+            with metrics.stage("train.batch_transform"):
+                input = batch_transform(input)
 
         # calculate loss
-        prediction = model(input)
-        loss = loss_fn(prediction, target)
+        with metrics.stage("train.forward"):
+            prediction = model(input)
+            loss = loss_fn(prediction, target)
 
         # backpropagate error and update weights
-        optimiser.zero_grad()
-        loss.backward()
-        optimiser.step()
+        with metrics.stage("train.backward"):
+            optimiser.zero_grad()
+            loss.backward()
+            optimiser.step()
 
-    print(f"loss: {loss.item()}")
+        total_loss += loss.item()
+        num_batches += 1
 
+    if metrics.is_enabled():
+        metrics.record("train.epoch", time.perf_counter() - epoch_start_time)
+
+    mean_loss = total_loss / max(num_batches, 1)
+    print(f"loss: {mean_loss}")
+    return mean_loss
+
+
+def evaluate(model, data_loader, loss_fn, device, batch_transform=None):
+    """
+    Compute the mean loss and the accuracy of the model on a data loader.
+    Batch augmentation is disabled, because the transform is switched to evaluation mode.
+
+    Returns:
+    tuple: Mean loss and accuracy.
+    """
+    model.eval()
+    if batch_transform is not None:
+        batch_transform.eval()
+
+    total_loss = 0.0
+    num_correct = 0
+    num_samples = 0
+    with torch.no_grad():
+        for input, target in data_loader:
+            input, target = input.to(device, non_blocking=True), target.to(device, non_blocking=True)
+            if batch_transform is not None:
+                input = batch_transform(input)
+
+            prediction = model(input)
+            total_loss += loss_fn(prediction, target).item() * len(target)
+            num_correct += (prediction.argmax(1) == target).sum().item()
+            num_samples += len(target)
+
+    model.train()
+    if num_samples == 0:
+        return float("nan"), float("nan")
+    return total_loss / num_samples, num_correct / num_samples
+
+
+def new_training_state():
+    """ Progress of a training run, as stored in its checkpoints """
+    return {
+        "epoch": 0,
+        "best_loss": float("inf"),
+        "best_state": None,
+        "epochs_without_improvement": 0,
+        "stopped_early": False
+    }
+
+
+def train(model, data_loader, loss_fn, optimiser, device, epochs, progress_bar, batch_transform=None,
+          validation_loader=None, patience=PATIENCE, state=None, on_epoch_end=None, cancel_event=None):
+    """
+    Train for up to `epochs` epochs. With a validation loader, training stops once the validation
+    loss has not improved for `patience` epochs, and the model is left with the weights of the
+    best epoch.
+
+    Parameters:
+    - state (dict): Progress of an interrupted run to resume, see new_training_state.
+    - on_epoch_end (callable): Called with the state after every completed epoch, e.g. to checkpoint it.
+    - cancel_event (threading.Event): Stops training cooperatively when set. The interrupted epoch
+      is discarded, so a resumed run repeats it.
+
+    Returns:
+    dict: Progress of the run.
+    """
+    if state is None:
+        state = new_training_state()
+
+    for i in range(state["epoch"], epochs):
+        if state["stopped_early"] or (cancel_event is not None and cancel_event.is_set()):
+            break
 
-def train(model, data_loader, loss_fn, optimiser, device, epochs, progress_bar):
-    for i in range(epochs):
         print(f"Epoch {i+1}")
-        progress_bar.step()
-        train_single_epoch(model, data_loader, loss_fn, optimiser, device)
+        if progress_bar is not None:
+            progress_bar.step()
+        train_single_epoch(model, data_loader, loss_fn, optimiser, device, batch_transform, cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            break
+
+        if validation_loader is not None:
+            validation_loss, validation_accuracy = evaluate(model, validation_loader, loss_fn, device,
+                                                            batch_transform)
+            print(f"validation loss: {validation_loss}, validation accuracy: {validation_accuracy:.3f}")
+
+            if validation_loss < state["best_loss"] - MIN_DELTA:
+                state["best_loss"] = validation_loss
+                state["best_state"] = copy.deepcopy(model.state_dict())
+                state["epochs_without_improvement"] = 0
+            else:
+                state["epochs_without_improvement"] += 1
+                if state["epochs_without_improvement"] >= patience:
+                    print(f"No improvement for {patience} epochs, stopping early")
+                    state["stopped_early"] = True
+
+        state["epoch"] = i + 1
+        if on_epoch_end is not None:
+            on_epoch_end(state)
         print("---------------------------")
 
+    if progress_bar is not None:
+        progress_bar.stop()
+        progress_bar.grid_forget()
+
+    if cancel_event is not None and cancel_event.is_set():
+        print("Training cancelled")
+        return state
+
+    if state["best_state"] is not None:
+        model.load_state_dict(state["best_state"])
+        print(f"Restored the best epoch, validation loss: {state['best_loss']}")
+
+    print("Finished training")
+    return state
+
+
+def fine_tune(model, data_loader, loss_fn, optimiser, device, steps, progress_bar, batch_transform=None,
+              cancel_event=None):
+    """
+    Run a bounded number of optimisation steps, cycling over the data loader if needed.
+    """
+    step = 0
+    while step < steps and len(data_loader) > 0:
+        for input, target in data_loader:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+
+            input, target = input.to(device, non_blocking=True), target.to(device, non_blocking=True)
+            if batch_transform is not None:
+                input = batch_transform(input)
+
+            prediction = model(input)
+            loss = loss_fn(prediction, target)
+
+            optimiser.zero_grad()
+            loss.backward()
+            optimiser.step()
+
+            progress_bar.step()
+            step += 1
+            if step >= steps:
+                break
+
+        if cancel_event is not None and cancel_event.is_set():
+            print("Fine-tuning cancelled")
+            break
+
+        print(f"Step {step}, loss: {loss.item()}")
+
     progress_bar.stop()
     progress_bar.grid_forget()
-    print("Finished training")
+    print("Finished fine-tuning")
 
 
-def start_training(*args):
-    progress_bar, train_widgets = args[0], args[1]
+def save_torch_atomically(obj, path):
+    """ Save with torch.save to a temporary file first, so readers never see a partial file """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
 
-    progress_bar.grid(row=3, column=0, padx=10, pady=(20, 0), columnspan=2, sticky="ew")
-    progress_bar.start()
 
+def get_rng_state():
+    rng_state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state()
+    }
     if torch.cuda.is_available():
-        device = "cuda"
-    else:
-        device = "cpu"
+        rng_state["cuda"] = torch.cuda.get_rng_state_all()
+    return rng_state
 
-    print(f"Using {device}")
 
-    usd = AppDataset(ANNOTATIONS_FILE,
-                     AUDIO_DIR,
-                     mel_spectrogram,
-                     SAMPLE_RATE,
-                     NUM_SAMPLES,
-                     device)
+def set_rng_state(rng_state):
+    random.setstate(rng_state["python"])
+    np.random.set_state(rng_state["numpy"])
+    torch.set_rng_state(rng_state["torch"])
+    if "cuda" in rng_state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_state["cuda"])
+
+
+def save_checkpoint(checkpoint_path, model, optimiser, state, file_names, train_indices, validation_indices):
+    """
+    Save everything needed to resume a training run: model, optimiser, progress, RNG state,
+    and the dataset and split it was trained on.
+    """
+    save_torch_atomically({
+        "model": model.state_dict(),
+        "num_classes": model.num_classes,
+        "optimiser": optimiser.state_dict(),
+        "training_state": state,
+        "rng_state": get_rng_state(),
+        "file_names": file_names,
+        "train_indices": train_indices,
+        "validation_indices": validation_indices
+    }, checkpoint_path)
+
+
+def publish_model(model):
+    """
+    Atomically replace feedforwardnet.pth, so inference never loads a partially written model.
+    """
+    save_torch_atomically(model.state_dict(), get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME))
+
+
+def load_checkpoint(checkpoint_path, device):
+    """ Return the saved checkpoint, or None if there is no usable one """
+    if not os.path.isfile(checkpoint_path):
+        return None
+    try:
+        return torch.load(checkpoint_path, map_location=device, weights_only=False)
+    except (OSError, RuntimeError, EOFError) as e:
+        print(f"Ignoring unreadable checkpoint {checkpoint_path}: {e}")
+        return None
+
+
+def select_fine_tune_indices(annotations, new_file_names, replay_ratio):
+    """
+    Pick the rows of the new recordings plus a random replay sample of the older rows.
+
+    Parameters:
+    - annotations (pd.DataFrame): Training metadata.
+    - new_file_names (list): File names of the newly enrolled clips.
+    - replay_ratio (int): Number of old clips replayed per new clip.
+
+    Returns:
+    list: Dataset indices to fine-tune on.
+    """
+    is_new = annotations['file_name'].isin(set(new_file_names)).to_numpy()
+    new_indices = [i for i in range(len(annotations)) if is_new[i]]
+    old_indices = [i for i in range(len(annotations)) if not is_new[i]]
+
+    num_replay = min(len(old_indices), replay_ratio * len(new_indices))
+    return new_indices + random.sample(old_indices, num_replay)
+
+
+def run_training(progress_bar=None, resume=True, cancel_event=None):
+    """
+    Train a new model on the whole dataset, checkpointing after every CHECKPOINT_EVERY_EPOCHS epochs.
+
+    Parameters:
+    - progress_bar (CTkProgressBar): Progress bar stepped once per epoch, or None.
+    - resume (bool): Continue from the last checkpoint if it was made for the same dataset.
+    - cancel_event (threading.Event): Stops training cooperatively when set.
 
-    train_dataloader = create_data_loader(usd, BATCH_SIZE)
-    cnn = CNNNetwork().to(device)
+    Returns:
+    CNNNetwork: The trained model, or None if training was cancelled.
+    """
+    device = get_device()
+
+    usd = create_dataset()
+    file_names = list(usd.annotations['file_name'])
+
+    checkpoint_path = get_file_path(MODEL_SAVE_PATH, CHECKPOINT_NAME)
+    checkpoint = load_checkpoint(checkpoint_path, device) if resume else None
+    if checkpoint is not None and checkpoint["file_names"] != file_names:
+        print("The dataset has changed since the last checkpoint, training from scratch")
+        checkpoint = None
+
+    if checkpoint is not None:
+        train_indices, validation_indices = checkpoint["train_indices"], checkpoint["validation_indices"]
+    else:
+        train_indices, validation_indices = split_indices(recording_groups(usd.annotations), VALIDATION_SPLIT)
+
+    train_dataloader = create_data_loader(Subset(usd, train_indices), BATCH_SIZE, shuffle=True)
+    if validation_indices:
+        # online augmentation is not applied to the validation clips
+        validation_data = usd if AUGMENTATION_MODE != AUGMENTATION_MODE_ONLINE else \
+            create_dataset(AUGMENTATION_MODE_MATERIALIZED)
+        validation_dataloader = create_data_loader(Subset(validation_data, validation_indices), BATCH_SIZE)
+    else:
+        validation_dataloader = None
+
+    if checkpoint is not None:
+        num_classes = checkpoint["num_classes"]
+    else:
+        num_classes = max(NUM_CLASSES, int(usd.annotations['classID'].max()) + 1)
+    cnn = CNNNetwork(num_classes).to(device)
 
     # initialise loss funtion + optimiser
     loss_fn = nn.CrossEntropyLoss()
     optimiser = torch.optim.Adam(cnn.parameters(),
                                  lr=LEARNING_RATE)
 
-    train_widgets.train_record_btn.configure(state="disabled")
-    train_widgets.train_stop_btn.configure(state="disabled")
+    state = None
+    if checkpoint is not None:
+        cnn.load_state_dict(checkpoint["model"])
+        optimiser.load_state_dict(checkpoint["optimiser"])
+        state = checkpoint["training_state"]
+        set_rng_state(checkpoint["rng_state"])
+        print(f"Resuming from epoch {state['epoch'] + 1}")
+
+    def on_epoch_end(state):
+        if state["epoch"] % CHECKPOINT_EVERY_EPOCHS == 0 or state["stopped_early"]:
+            save_checkpoint(checkpoint_path, cnn, optimiser, state, file_names, train_indices, validation_indices)
 
     # train model
-    train(cnn, train_dataloader, loss_fn, optimiser, device, EPOCHS, progress_bar)
+    train(cnn, train_dataloader, loss_fn, optimiser, device, EPOCHS, progress_bar, create_batch_transform(device),
+          validation_dataloader, state=state, on_epoch_end=on_epoch_end, cancel_event=cancel_event)
 
-    model_path = get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME)
+    if cancel_event is not None and cancel_event.is_set():
+        return None
+
+    # the run is complete, there is nothing left to resume
+    if os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+    return cnn
 
-    # save model
-    torch.save(cnn.state_dict(), model_path)
-    print("Trained feed forward net saved at feedforwardnet.pth")
+
+def restore_train_widgets(progress_bar, train_widgets):
+    """ Hide the progress bar and re-enable recording after a training job, also if it failed """
+    progress_bar.stop()
+    progress_bar.grid_forget()
 
     train_widgets.train_record_btn.configure(state="normal")
     train_widgets.train_stop_btn.configure(state="normal")
+    train_widgets.train_cancel_btn.configure(state="disabled")
+
+
+def start_training(progress_bar, train_widgets, cancel_event=None):
+    """
+    Train a new model from the GUI and publish it.
+
+    Returns:
+    bool: True if a model was published, False if training was cancelled.
+    """
+    progress_bar.grid(row=3, column=0, padx=10, pady=(20, 0), columnspan=2, sticky="ew")
+    progress_bar.start()
+
+    train_widgets.train_record_btn.configure(state="disabled")
+    train_widgets.train_stop_btn.configure(state="disabled")
+    train_widgets.train_cancel_btn.configure(state="normal")
+
+    try:
+        cnn = run_training(progress_bar, cancel_event=cancel_event)
+
+        published = cnn is not None and (cancel_event is None or not cancel_event.is_set())
+        if published:
+            # save model
+            publish_model(cnn)
+            print("Trained feed forward net saved at feedforwardnet.pth")
+    finally:
+        restore_train_widgets(progress_bar, train_widgets)
+
+    return published
+
+
+def start_fine_tuning(progress_bar, train_widgets, new_file_names, cancel_event=None):
+    """
+    Warm-start the saved model on newly enrolled clips instead of training from scratch.
+    Output units are added for speakers the saved model does not know yet.
+
+    Returns:
+    bool: True if the fine-tuned model was published, False if fine-tuning was cancelled.
+    """
+
+    progress_bar.grid(row=3, column=0, padx=10, pady=(20, 0), columnspan=2, sticky="ew")
+    progress_bar.start()
+
+    train_widgets.train_record_btn.configure(state="disabled")
+    train_widgets.train_stop_btn.configure(state="disabled")
+    train_widgets.train_cancel_btn.configure(state="normal")
+
+    try:
+        device = get_device()
+
+        usd = create_dataset()
+        indices = select_fine_tune_indices(usd.annotations, new_file_names, REPLAY_RATIO)
+        # starting worker processes would take longer than loading the few clips
+        fine_tune_dataloader = create_data_loader(Subset(usd, indices), BATCH_SIZE, shuffle=True,
+                                                  num_workers=FINE_TUNE_NUM_WORKERS)
+
+        model_path = get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME)
+        state_dict = torch.load(model_path, map_location=device)
+        cnn = CNNNetwork(num_classes_in_state_dict(state_dict)).to(device)
+        cnn.load_state_dict(state_dict)
+        cnn.expand_output(int(usd.annotations['classID'].max()) + 1)
+        cnn.train()
+
+        loss_fn = nn.CrossEntropyLoss()
+        optimiser = torch.optim.Adam(cnn.parameters(),
+                                     lr=FINE_TUNE_LEARNING_RATE)
+
+        fine_tune(cnn, fine_tune_dataloader, loss_fn, optimiser, device, FINE_TUNE_STEPS, progress_bar,
+                  create_batch_transform(device), cancel_event)
+
+        published = cancel_event is None or not cancel_event.is_set()
+        if published:
+            publish_model(cnn)
+            print("Fine-tuned feed forward net saved at feedforwardnet.pth")
+    finally:
+        restore_train_widgets(progress_bar, train_widgets)
+
+    return published
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the speaker classifier on the enrolled recordings.")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore the last checkpoint and start over")
+    args = parser.parse_args()
+
+    # Ctrl+C stops after the current batch; the last checkpoint is kept for the next run
+    cancel_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_event.set())
+
+    cnn = run_training(resume=not args.no_resume, cancel_event=cancel_event)
+    if cnn is None:
+        print("Training cancelled, run again without changing the dataset to resume from the last checkpoint")
+        return
+
+    publish_model(cnn)
+    print("Trained feed forward net saved at feedforwardnet.pth")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,7 @@
-import csv
 import os
+import shutil
 import sys
 
-import torchaudio
-
 APP_NAME = "Voice Classifier App"
 MAIN_WINDOW_WIDTH_PERCENT = 30
 MAIN_WINDOW_HEIGHT_PERCENT = 40
@@ -11,21 +9,85 @@ MAIN_WINDOW_HEIGHT_PERCENT = 40
 TRAIN_DIR = "ml_scripts/dataset/train"
 TRAIN_METADATA_DIR = "ml_scripts/dataset/"
 TRAIN_METADATA_FILENAME = "train_metadata.csv"
+METADATA_DB_FILENAME = "train_metadata.db"
 
 TEST_DIR = "ml_scripts/dataset/test"
 
 SAMPLE_RATE = 22050
 NUM_SAMPLES = 22050
 
+# Fallback microphone sample rate if the device cannot record at SAMPLE_RATE
+RECORDING_SAMPLE_RATE = 44100
+
 MODEL_SAVE_NAME = "feedforwardnet.pth"
+CHECKPOINT_NAME = "checkpoint.pth"
+
+# Inference artifacts exported next to feedforwardnet.pth by ml_scripts.export
+MODEL_ARTIFACT_EAGER = "eager"
+MODEL_ARTIFACT_TORCHSCRIPT = "torchscript"
+MODEL_ARTIFACT_QUANTIZED = "quantized"
+MODEL_ARTIFACT_ONNX = "onnx"
+MODEL_ARTIFACT_NAMES = {
+    MODEL_ARTIFACT_EAGER: MODEL_SAVE_NAME,
+    MODEL_ARTIFACT_TORCHSCRIPT: "feedforwardnet.torchscript.pt",
+    MODEL_ARTIFACT_QUANTIZED: "feedforwardnet.int8.torchscript.pt",
+    MODEL_ARTIFACT_ONNX: "feedforwardnet.onnx"
+}
+# Artifact used for inference. Falls back to the eager model if the artifact is missing or
+# older than feedforwardnet.pth
+MODEL_ARTIFACT = MODEL_ARTIFACT_EAGER
 MODEL_SAVE_PATH = "ml_scripts/models"
 
-mel_spectrogram = torchaudio.transforms.MelSpectrogram(
-    sample_rate=SAMPLE_RATE,
-    n_fft=1024,
-    hop_length=512,
-    n_mels=64
-)
+# "window": classify the most voiced NUM_SAMPLES window of a recording
+# "utterance": classify overlapping windows covering the whole recording in one batch and
+# aggregate their probabilities
+PREDICTION_MODE_WINDOW = "window"
+PREDICTION_MODE_UTTERANCE = "utterance"
+PREDICTION_MODE = PREDICTION_MODE_UTTERANCE
+UTTERANCE_HOP_SAMPLES = NUM_SAMPLES // 2
+# "mean": average of the window probabilities
+# "log": mean of the window log probabilities, i.e. windows vote with their confidence
+UTTERANCE_AGGREGATION_MEAN = "mean"
+UTTERANCE_AGGREGATION_LOG = "log"
+UTTERANCE_AGGREGATION = UTTERANCE_AGGREGATION_MEAN
+
+FEATURE_CACHE_DIR = "ml_scripts/dataset/cache"
+
+# Train from a packed, memory-mapped waveform shard instead of the individual WAV files
+USE_WAVEFORM_SHARDS = False
+SHARD_DIR = "ml_scripts/dataset/shards"
+
+# "materialized": augmented copies of every recording are written to TRAIN_DIR
+# "online": the training pipeline augments the original recordings at load time
+# "batch": whole waveform batches are augmented with torch on the training device
+AUGMENTATION_MODE_MATERIALIZED = "materialized"
+AUGMENTATION_MODE_ONLINE = "online"
+AUGMENTATION_MODE_BATCH = "batch"
+AUGMENTATION_MODE = AUGMENTATION_MODE_MATERIALIZED
+
+N_FFT = 1024
+HOP_LENGTH = 512
+N_MELS = 64
+
+_mel_spectrogram = None
+
+
+def get_mel_spectrogram():
+    """
+    Return the mel spectrogram transform of the model. It is built on first use,
+    so importing utils does not import torchaudio.
+    """
+    global _mel_spectrogram
+    if _mel_spectrogram is None:
+        import torchaudio
+
+        _mel_spectrogram = torchaudio.transforms.MelSpectrogram(
+            sample_rate=SAMPLE_RATE,
+            n_fft=N_FFT,
+            hop_length=HOP_LENGTH,
+            n_mels=N_MELS
+        )
+    return _mel_spectrogram
 
 
 def resource_path(relative_path):
@@ -46,17 +108,28 @@ def get_file_path(dir_path, filename):
     return os.path.join(abs_path, filename)
 
 
-def log_into_csv(data):
-    """ Logs into csv newly created audio file for training """
-    log_file_path = get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME)
-    with open(log_file_path, mode='a', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=data.keys())
-        writer.writerow(data)
+def find_input_sample_rate(p, input_format):
+    """
+    Pick the microphone sample rate. SAMPLE_RATE is preferred, so recordings need no resampling.
+
+    Parameters:
+    - p (pyaudio.PyAudio): PyAudio instance.
+    - input_format (int): PyAudio sample format of the stream.
+    """
+    for rate in (SAMPLE_RATE, RECORDING_SAMPLE_RATE):
+        try:
+            if p.is_format_supported(rate, input_device=p.get_default_input_device_info()["index"],
+                                     input_channels=1, input_format=input_format):
+                return rate
+        except (ValueError, IOError):
+            continue
+    return RECORDING_SAMPLE_RATE
 
 
 def truncate_metadata():
     """
-    Deletes all the records from the train_metadata.csv
+    Deletes all the records from the legacy train_metadata.csv,
+    so they are not imported again into the metadata store
     """
     # clear the train_metadata.csv
     metadata_file = get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME)
@@ -78,3 +151,11 @@ def delete_train_dataset():
             os.remove(f"{train_folder}/{filename}")
     except FileNotFoundError:
         pass
+
+
+def delete_feature_cache():
+    """
+    Deletes all the cached mel-spectrogram features and the packed waveform shard
+    """
+    shutil.rmtree(resource_path(FEATURE_CACHE_DIR), ignore_errors=True)
+    shutil.rmtree(resource_path(SHARD_DIR), ignore_errors=True)
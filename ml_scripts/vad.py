@@ -0,0 +1,74 @@
+import math
+
+import numpy as np
+
+# Energy based voice activity detection on frames of VAD_FRAME_MS
+VAD_FRAME_MS = 20
+# Frames this much louder than the noise floor (the 10th percentile of the frame energies) are voiced
+VAD_MARGIN_DB = 12.0
+# Absolute threshold, quieter frames are never voiced
+VAD_MIN_DBFS = -55.0
+# Frames within this range of the loudest frame are voiced even in a noisy recording,
+# unless they are quieter than VAD_MIN_DBFS
+VAD_PEAK_RANGE_DB = 6.0
+# Voiced regions are extended by this much on both sides, which keeps word onsets and short pauses
+VAD_HANGOVER_MS = 150
+
+
+def frame_energies(samples, frame_length):
+    """
+    Mean power of consecutive frames of a float waveform. A last partial frame is dropped,
+    unless the waveform is shorter than one frame.
+    """
+    num_frames = max(1, len(samples) // frame_length)
+    frames = np.resize(samples, num_frames * frame_length) if len(samples) < frame_length else \
+        samples[:num_frames * frame_length]
+    return np.mean(np.square(frames.reshape(num_frames, -1), dtype=np.float64), axis=1)
+
+
+def detect_voiced_frames(samples, sample_rate, frame_ms=VAD_FRAME_MS):
+    """
+    Mark the voiced frames of a float waveform in [-1, 1].
+
+    Returns:
+    tuple: Boolean array with one entry per frame, and the frame length in samples.
+    """
+    frame_length = max(1, int(sample_rate * frame_ms / 1000))
+    energies_db = 10 * np.log10(np.maximum(frame_energies(samples, frame_length), 1e-12))
+
+    noise_floor = np.percentile(energies_db, 10)
+    # the absolute threshold is applied last, so a recording of only quiet noise has no voiced frames
+    threshold = max(VAD_MIN_DBFS, min(noise_floor + VAD_MARGIN_DB, energies_db.max() - VAD_PEAK_RANGE_DB))
+    voiced = energies_db > threshold
+
+    hangover = int(math.ceil(VAD_HANGOVER_MS / frame_ms))
+    dilated = np.convolve(voiced.astype(np.float32), np.ones(2 * hangover + 1))
+    voiced = dilated[hangover:hangover + len(voiced)] > 0
+    return voiced, frame_length
+
+
+def trim_recording(pcm, sample_rate):
+    """
+    Remove the leading and trailing silence of a recording. Everything from the first to the
+    last voiced frame is kept, including the pauses in between.
+
+    Parameters:
+    - pcm (bytes): Mono 16-bit PCM audio.
+    - sample_rate (int): Sample rate of the audio.
+
+    Returns:
+    bytes: The trimmed 16-bit PCM audio, or pcm unchanged if no voice was detected.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if len(samples) == 0:
+        return pcm
+
+    voiced, frame_length = detect_voiced_frames(samples.astype(np.float32) / 32768, sample_rate)
+    voiced_frames = np.flatnonzero(voiced)
+    if len(voiced_frames) == 0:
+        return pcm
+
+    start = voiced_frames[0] * frame_length
+    # the samples after the last full frame belong to the last frame
+    end = len(samples) if voiced_frames[-1] == len(voiced) - 1 else (voiced_frames[-1] + 1) * frame_length
+    return samples[start:end].tobytes()
@@ -1,7 +1,8 @@
 import os
 import customtkinter
-from ml_scripts.utils import get_file_path, MODEL_SAVE_PATH, MODEL_SAVE_NAME, truncate_metadata, \
-    delete_train_dataset
+from ml_scripts.metadata_store import get_metadata_store
+from ml_scripts.utils import get_file_path, MODEL_SAVE_PATH, MODEL_ARTIFACT_NAMES, CHECKPOINT_NAME, truncate_metadata, \
+    delete_train_dataset, delete_feature_cache
 
 
 class ResetWidgets:
@@ -42,16 +43,20 @@ class ResetWidgets:
     def reset_training(self):
         """
         Clear training data by:
-        - truncating train_metadata.csv
+        - deleting all the rows of the metadata store and of the legacy train_metadata.csv
         - deleting audio files in the dataset/train folder
-        - deleting saved model
+        - deleting cached audio features and packed waveforms
+        - deleting saved model, its exports and the training checkpoint
         """
+        get_metadata_store().clear()
         truncate_metadata()
         delete_train_dataset()
+        delete_feature_cache()
 
-        saved_model = get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME)
-        if os.path.isfile(saved_model):
-            os.remove(saved_model)
+        for file_name in (CHECKPOINT_NAME, *MODEL_ARTIFACT_NAMES.values()):
+            saved_file = get_file_path(MODEL_SAVE_PATH, file_name)
+            if os.path.isfile(saved_file):
+                os.remove(saved_file)
 
         self.status_label.grid(row=0, column=0, padx=10, pady=(20, 0), sticky="w")
 
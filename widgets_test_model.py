@@ -1,7 +1,6 @@
 import time
-import wave
-import pandas as pd
-from ml_scripts.inference import predict
+from ml_scripts.metadata_store import get_metadata_store
+from ml_scripts.vad import trim_recording
 import customtkinter
 import threading
 from ml_scripts.utils import *
@@ -25,6 +24,8 @@ class TestModelWidgets:
         self.frames = []
         self.audio_stream = None
         self.audio_thread = None
+        self.streaming_predictor = None
+        self.sample_rate = RECORDING_SAMPLE_RATE
 
     def create_widgets(self):
         """
@@ -57,6 +58,9 @@ class TestModelWidgets:
                                                        text="",
                                                        font=("Times", 18, "bold"))
 
+        self.live_mode_switch = customtkinter.CTkSwitch(self.parent_frame,
+                                                        text="Live prediction while speaking")
+
         self.hide_widgets()
 
         self.test_record_btn.configure(command=self.start_recording)
@@ -69,6 +73,7 @@ class TestModelWidgets:
         self.test_input_label.grid(row=0, column=0, padx=10, pady=(20, 0), sticky="w")
         self.test_record_btn.grid(row=2, column=0, padx=10, pady=(20, 0), sticky="ew")
         self.test_stop_btn.grid(row=2, column=1, padx=10, pady=(20, 0), sticky="ew")
+        self.live_mode_switch.grid(row=3, column=0, padx=10, pady=(20, 0), columnspan=2, sticky="w")
 
     def hide_widgets(self):
         """
@@ -80,6 +85,7 @@ class TestModelWidgets:
         self.prediction_label.grid_forget()
         self.test_input_label.grid_forget()
         self.model_is_not_trained_label.grid_forget()
+        self.live_mode_switch.grid_forget()
 
     def start_recording(self):
         """
@@ -98,6 +104,14 @@ class TestModelWidgets:
             self.frames = []
             self.audio_stream = self.init_audio_stream()
 
+            if self.live_mode_switch.get():
+                from ml_scripts.inference import get_inference_engine
+                from ml_scripts.streaming import StreamingPredictor
+
+                self.streaming_predictor = StreamingPredictor(get_inference_engine(), self.sample_rate,
+                                                              self.show_live_prediction)
+                self.streaming_predictor.start()
+
             # Start a new thread for recording
             self.audio_thread = threading.Thread(target=self.record_audio)
             self.audio_thread.start()
@@ -114,7 +128,15 @@ class TestModelWidgets:
         if self.recording and self.is_model_trained():
             self.recording = False
             self.audio_thread.join()  # Wait for the recording thread to finish
-            self.save_audio()
+
+            if self.streaming_predictor is not None:
+                # The live prediction is already shown, there is nothing left to classify
+                self.streaming_predictor.stop()
+                self.streaming_predictor = None
+                self.audio_stream.stop_stream()
+                self.audio_stream.close()
+            else:
+                self.save_audio()
 
     def start_recording_animation(self):
         """
@@ -132,66 +154,68 @@ class TestModelWidgets:
     def init_audio_stream(self):
         """
         Initialize audio stream for recording.
+        The model's sample rate is used if the microphone supports it.
         """
         p = pyaudio.PyAudio()
+        self.sample_rate = find_input_sample_rate(p, pyaudio.paInt16)
         stream = p.open(format=pyaudio.paInt16,
                         channels=1,
-                        rate=44100,
+                        rate=self.sample_rate,
                         input=True,
                         frames_per_buffer=1024)
         return stream
 
     def record_audio(self):
         """
-        Record audio and append frames.
+        Record audio and append frames. In live mode the frames are streamed to the predictor
+        instead of being kept for the whole recording.
         """
         while self.recording:
             data = self.audio_stream.read(1024)
-            self.frames.append(data)
+            if self.streaming_predictor is not None:
+                self.streaming_predictor.push(data)
+            else:
+                self.frames.append(data)
+
+    def show_live_prediction(self, predicted, probabilities):
+        """
+        Show the rolling prediction of the streaming predictor.
+
+        Parameters:
+        - predicted (str): Currently predicted class.
+        - probabilities (torch.Tensor): Rolling class probabilities.
+        """
+        self.prediction_label.configure(text=f"Predicted value: {predicted}")
+        # row 1 is taken by the recording animation while the user is speaking
+        self.prediction_label.grid(row=4, column=0, padx=10, pady=(20, 0), columnspan=2, sticky="ew")
 
     def save_audio(self):
         """
-        Save the recorded audio.
+        Pass the voiced part of the recorded audio to the model. The frames stay in memory,
+        so no test file is written and read back.
         """
         self.audio_stream.stop_stream()
         self.audio_stream.close()
 
-        p = pyaudio.PyAudio()
-
-        # Generate name for the test audio file
-
-        file_name = "test.wav"
-        file_path = get_file_path(TEST_DIR, file_name)
+        # In utterance mode every window is classified, otherwise only the most voiced one
+        self.test_model(trim_recording(b''.join(self.frames), self.sample_rate))
 
-        wf = wave.open(file_path, "wb")
-        wf.setnchannels(1)
-        wf.setsampwidth(p.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(44100)
-        wf.writeframes(b''.join(self.frames))
-        wf.close()
-
-        self.test_model(file_path)
-
-    def test_model(self, file_path):
+    def test_model(self, pcm):
         """
-        Asynchronously tests the trained model on the specified audio file using a separate thread.
+        Asynchronously tests the trained model on the recorded audio using a separate thread.
 
         Parameters:
         - self: Instance of the class containing this method.
-        - file_path (str): Path to the audio file to be tested.
+        - pcm (bytes): Recorded 16-bit mono PCM audio.
         """
-        threading.Thread(target=predict, args=(self, file_path)).start()
+        # torch and the model are imported on first use, not at startup
+        from ml_scripts.inference import predict
+
+        threading.Thread(target=predict, args=(self, pcm, self.sample_rate)).start()
 
     def is_model_trained(self):
         """
         Check if the model is trained. If the model is not trained, the "Test Model" function will not work.
         :returns: True if there model is trained, False otherwise.
         """
-        metadata_path = get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME)
-        try:
-            metadata = pd.read_csv(metadata_path)
-            unique_classes = metadata['class'].unique()
-            return len(unique_classes) > 0
-        except pd.errors.EmptyDataError:
-            return False
-
+        return get_metadata_store().has_classes()
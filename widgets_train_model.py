@@ -1,13 +1,11 @@
-import wave
 import customtkinter
 import tkinter as tk
 import threading
 import time
-import pandas as pd
 import pyaudio
+from ml_scripts.metadata_store import get_metadata_store
 from ml_scripts.utils import *
-from augmentation import augment_audio
-from ml_scripts.train import start_training
+from ml_scripts.scheduler import TrainingScheduler
 
 
 class TrainModelWidgets:
@@ -21,8 +19,13 @@ class TrainModelWidgets:
         self.parent_frame = parent_frame
         self.recording = False
 
-        # Initialize csv metadata file for training dataset if it does not exist
-        self.setup_csv_file()
+        # Open the metadata store, importing the legacy CSV metadata file on first use
+        self.metadata_store = get_metadata_store()
+
+        # Trains the enrolled recordings, one job at a time
+        self.training_scheduler = TrainingScheduler(self.run_training_job)
+        # Recordings are stored one at a time, so each gets its own audio ids
+        self.ingest_lock = threading.Lock()
 
         self.create_widgets()
         self.validate_name_entry()
@@ -31,6 +34,7 @@ class TrainModelWidgets:
         self.frames = []
         self.audio_stream = None
         self.audio_thread = None
+        self.sample_rate = RECORDING_SAMPLE_RATE
 
     def create_widgets(self):
         """
@@ -59,6 +63,12 @@ class TrainModelWidgets:
                                                       fg_color="#343a40",
                                                       hover_color="#495057")
 
+        self.train_cancel_btn = customtkinter.CTkButton(self.parent_frame,
+                                                        text="Cancel training",
+                                                        fg_color="#8b0000",
+                                                        hover_color="#a52a2a",
+                                                        state="disabled")
+
         self.progress_bar = customtkinter.CTkProgressBar(self.parent_frame,
                                                          width=200,
                                                          mode="indeterminate")
@@ -71,6 +81,7 @@ class TrainModelWidgets:
 
         self.train_record_btn.configure(command=self.start_recording)
         self.train_stop_btn.configure(command=self.stop_recording)
+        self.train_cancel_btn.configure(command=self.training_scheduler.cancel)
 
     def validate_name_entry(self, *args):
         """
@@ -107,6 +118,7 @@ class TrainModelWidgets:
         self.train_input_entry.grid(row=1, column=0, padx=10, pady=(20, 0), columnspan=2, sticky="ew")
         self.train_record_btn.grid(row=4, column=0, padx=10, pady=(20, 0), sticky="ew")
         self.train_stop_btn.grid(row=4, column=1, padx=10, pady=(20, 0), sticky="ew")
+        self.train_cancel_btn.grid(row=5, column=0, padx=10, pady=(20, 0), columnspan=2, sticky="ew")
 
     def hide_widgets(self):
         """
@@ -116,16 +128,19 @@ class TrainModelWidgets:
         self.train_input_entry.grid_forget()
         self.train_record_btn.grid_forget()
         self.train_stop_btn.grid_forget()
+        self.train_cancel_btn.grid_forget()
         self.progress_bar.grid_forget()
 
     def init_audio_stream(self):
         """
         Initialize audio stream for recording.
+        The model's sample rate is used if the microphone supports it.
         """
         p = pyaudio.PyAudio()
+        self.sample_rate = find_input_sample_rate(p, pyaudio.paInt16)
         stream = p.open(format=pyaudio.paInt16,
                         channels=1,
-                        rate=44100,
+                        rate=self.sample_rate,
                         input=True,
                         frames_per_buffer=1024)
         return stream
@@ -161,57 +176,89 @@ class TrainModelWidgets:
             self.audio_thread.join()  # Wait for the recording thread to finish
             self.save_audio()
 
-    def setup_csv_file(self):
+    def save_audio(self):
         """
-        Initialize CSV metadata file for training dataset if it does not exist.
+        Hand the recorded audio to a background thread, which stores and trains it, so the
+        Tk main thread is not blocked.
         """
-        metadata = get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME)
+        self.audio_stream.stop_stream()
+        self.audio_stream.close()
 
-        if not os.path.isfile(metadata):
-            with open(metadata, 'w', newline='') as file:
-                fields = ["file_name", "fold", "classID", "class"]
-                writer = csv.writer(file)
-                writer.writerow(fields)
+        user_name = self.train_input_entry_var.get().strip().lower()
+        threading.Thread(target=self.augment_and_train,
+                         args=(b''.join(self.frames), self.sample_rate, user_name)).start()
 
-    def save_audio(self):
+    def augment_and_train(self, pcm, sample_rate, user_name):
         """
-        Save the recorded audio.
+        Store a new recording, create its augmented versions (in materialized augmentation mode)
+        and train the model on them.
+
+        Parameters:
+        - pcm (bytes): Recorded mono 16-bit PCM audio.
+        - sample_rate (int): Sample rate of the recording.
+        - user_name (str): Name of the recorded user.
         """
-        self.audio_stream.stop_stream()
-        self.audio_stream.close()
+        # torch, librosa and audiomentations are imported on first use, not at startup
+        from ml_scripts.ingest import ingest_recording
 
-        p = pyaudio.PyAudio()
+        with self.ingest_lock:
+            filename, user_id, audio_id = self.get_filename_info(user_name)
 
-        self.setup_csv_file()
+            # Construct the full file path
+            file_path = get_file_path(TRAIN_DIR, filename)
 
-        user_name = self.train_input_entry_var.get().strip().lower()
-        filename, user_id, audio_id = self.get_filename_info(user_name)
+            # Resampled once here, so training never resamples the recording again.
+            # Leading and trailing silence is not stored
+            ingest_recording(pcm, sample_rate, file_path)
+
+            log_data = {
+                'file_name': filename,
+                'fold': file_path,
+                'classID': user_id,
+                'class': user_name
+            }
+
+            self.metadata_store.add_row(log_data)
 
-        # Construct the full file path
-        file_path = get_file_path(TRAIN_DIR, filename)
+            if AUGMENTATION_MODE != AUGMENTATION_MODE_MATERIALIZED:
+                # the training pipeline augments the recording itself
+                augmented_file_names = []
+            else:
+                from augmentation import augment_audio
 
-        wf = wave.open(file_path, "wb")
-        wf.setnchannels(1)
-        wf.setsampwidth(p.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(44100)
-        wf.writeframes(b''.join(self.frames))
-        wf.close()
+                # the augmented files take the following audio ids of the user
+                augmented_file_names = augment_audio(file_path, user_name, user_id, audio_id)
+
+        self.train_model([filename] + augmented_file_names)
+
+    def train_model(self, new_file_names):
+        """
+        Queue the new recordings for training. Recordings made in quick succession are trained
+        together in one job, and a running job is superseded by a newer one.
 
-        log_data = {
-            'file_name': filename,
-            'fold': file_path,
-            'classID': user_id,
-            'class': user_name
-        }
+        Parameters:
+        - new_file_names (list): File names of the recordings added since the last training.
+        """
+        self.training_scheduler.submit(new_file_names)
 
-        log_into_csv(log_data)
+    def run_training_job(self, new_file_names, cancel_event):
+        """
+        Run one training job on the scheduler thread. If a model has already been trained,
+        it is fine-tuned on the new recordings instead of being retrained from scratch.
 
-        augment_audio(file_path, user_name, user_id, audio_id)
+        Parameters:
+        - new_file_names (list): File names of the recordings added since the last published model.
+        - cancel_event (threading.Event): Set when the job is cancelled or superseded.
 
-        self.train_model()
+        Returns:
+        bool: True if a model was published.
+        """
+        # torch and the training pipeline are imported on first use, not at startup
+        from ml_scripts.train import start_training, start_fine_tuning
 
-    def train_model(self):
-        threading.Thread(target=start_training, args=(self.training_progress_bar, self)).start()
+        if os.path.isfile(get_file_path(MODEL_SAVE_PATH, MODEL_SAVE_NAME)):
+            return start_fine_tuning(self.training_progress_bar, self, new_file_names, cancel_event)
+        return start_training(self.training_progress_bar, self, cancel_event)
 
     def get_filename_info(self, user_name):
         """
@@ -223,28 +270,8 @@ class TrainModelWidgets:
         Audio files for training are located in dataset/train folder and have a naming format as:
         userid-username-audioid
         """
-        # Get the metadata file
-        metadata_path = get_file_path(TRAIN_METADATA_DIR, TRAIN_METADATA_FILENAME)
-        metadata = pd.read_csv(metadata_path)
-
-        # If len(metadata.index) is 0, then there are no audio recordings
-        num_rows = len(metadata.index)
-
-        if num_rows == 0:
-            # No data in the CSV file
-            user_id = 0
-            audio_id = 0
-            filename = f"{user_id}-{user_name}-{audio_id}.wav"
-        elif (metadata['class'] == user_name).any():
-            # User has some data in CSV
-            row = metadata.loc[metadata['class'] == user_name].iloc[-1]
-            audio_id = int(row["file_name"].replace(".wav", "").split("-")[2])
-            user_id = row['classID']
-            filename = f"{user_id}-{user_name}-{audio_id+1}.wav"
-        else:
-            # User does not have any data in CSV
-            user_id = int(metadata['classID'].max())+1
-            audio_id = 0
-            filename = f"{user_id}-{user_name}-{audio_id}.wav"
+        user_id = self.metadata_store.get_class_id(user_name)
+        audio_id = self.metadata_store.next_audio_id(user_name)
+        filename = f"{user_id}-{user_name}-{audio_id}.wav"
 
         return filename, user_id, audio_id